@@ -1,24 +1,45 @@
-from contextlib import asynccontextmanager
+import asyncio
+from contextlib import asynccontextmanager, suppress
 
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from config import get_config
 from logger.log_conf import LOGGING_CONFIG
+from metrics import MetricsMiddleware, mark_worker_dead
 from routers import routers_list
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    from database.partitions import run_partitions_maintenance
+    from cache import get_cache
     from database.session_manager import session_manager
+    from database.touches import touch_buffer
+    from charts import close_render_pool
     session_manager.init()
+    partitions_task = asyncio.create_task(run_partitions_maintenance(get_config().db.partitions_months_ahead))
+    touches_task = asyncio.create_task(touch_buffer.run())
+    replicas_task = asyncio.create_task(
+        session_manager.run_replicas_health_check(get_config().db.replica_check_interval)
+    )
     yield
+    for task in (partitions_task, touches_task, replicas_task):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await touch_buffer.flush()
     await session_manager.close()
+    close_render_pool()
+    if (cache := get_cache()) is not None:
+        await cache.close()
+    mark_worker_dead()
 
 
 def init_app() -> FastAPI:
-    app = FastAPI(lifespan=lifespan)
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
     app.add_middleware(
         CORSMiddleware,
@@ -27,6 +48,7 @@ def init_app() -> FastAPI:
         allow_methods=["*"],
         allow_headers=["*"],
     )
+    app.add_middleware(MetricsMiddleware)
 
     for router in routers_list:
         app.include_router(router)
@@ -35,10 +57,12 @@ def init_app() -> FastAPI:
 
 
 def main() -> None:
+    # Workers import the app by themselves, so it is given by import string of this module, not of `__main__`
     uvicorn.run(
-        "__main__:app",
+        "app:app",
         host=get_config().api.host,
         port=get_config().api.port,
+        workers=get_config().api.workers,
         log_config=LOGGING_CONFIG,
     )
 
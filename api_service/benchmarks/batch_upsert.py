@@ -0,0 +1,90 @@
+"""
+Benchmark of upserting users one by one and by `UserRepo.create_or_update_many`.
+
+For every size creates that many temporary users, then updates them, measuring both ways: one `create_or_update`
+(one statement and one transaction) per user and one `create_or_update_many` call for all of them.
+
+Run from the `api_service` directory:
+    python -m benchmarks.batch_upsert --sizes 1000 10000
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+from sqlalchemy import delete
+
+import schemas
+from database.models import User
+from database.repositories import UserRepo
+from database.session_manager import session_manager
+
+# Telegram IDs are far below this, so benchmark users don't clash with real ones
+FIRST_USER_ID: int = 9_100_000_000_000
+
+
+def get_users(size: int, first_user_id: int, run: str) -> List[schemas.UserBase]:
+    return [
+        schemas.UserBase(id=first_user_id + i, username=f'bench_{run}_{i}', language='en')
+        for i in range(size)
+    ]
+
+
+async def delete_users(from_id: int, amount: int) -> None:
+    async with session_manager.create_session() as session:
+        # Only ids of this benchmark, other benchmarks create their users after them
+        await session.execute(delete(User).where(User.id.between(from_id, from_id + amount - 1)))
+        await session.commit()
+
+
+async def upsert_one_by_one(users: List[schemas.UserBase]) -> float:
+    started_at = time.perf_counter()
+    async with session_manager.create_session() as session:
+        repo = UserRepo(session)
+        for user in users:
+            await repo.create_or_update(user_id=user.id, language=user.language, username=user.username)
+    return time.perf_counter() - started_at
+
+
+async def upsert_batch(users: List[schemas.UserBase]) -> float:
+    started_at = time.perf_counter()
+    async with session_manager.create_session() as session:
+        rows = await UserRepo(session).create_or_update_many(users)
+    assert len(rows) == len(users)
+    return time.perf_counter() - started_at
+
+
+async def main(sizes: List[int]) -> None:
+    session_manager.init()
+    results = []
+    try:
+        for size in sizes:
+            result = {"users": size}
+            for way, upsert, first_user_id in (
+                    ("one_by_one", upsert_one_by_one, FIRST_USER_ID),
+                    ("batch", upsert_batch, FIRST_USER_ID + size),
+            ):
+                create_seconds = await upsert(get_users(size, first_user_id, 'create'))
+                update_seconds = await upsert(get_users(size, first_user_id, 'update'))
+                result[way] = {
+                    "create_seconds": create_seconds,
+                    "update_seconds": update_seconds,
+                    "users_per_second": 2 * size / (create_seconds + update_seconds),
+                }
+            results.append(result)
+            await delete_users(FIRST_USER_ID, 2 * size)
+    finally:
+        await delete_users(FIRST_USER_ID, 2 * max(sizes))
+        await session_manager.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10_000],
+                        help='Amounts of users upserted per call.')
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sizes))
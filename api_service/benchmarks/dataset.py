@@ -0,0 +1,313 @@
+"""
+Generator of a synthetic dataset to test the database layer at scale.
+
+Fills the database (with the schema of Alembic migrations, so run `alembic upgrade head` first) with `--users`
+users and `--years` years of their hourly activities up to the current hour, using `COPY`. Every user gets
+a time zone, notify hours and a daily routine in local time: a sleep block, a work or study block on weekdays
+and weighted leisure in the other hours; some days are skipped as users don't fill every day. Activities are
+written to the storages of `POSTGRES_ACTIVITY_STORAGE` and rollups are filled, so the data is as if it was
+submitted through the API.
+
+The dataset is deterministic by `--seed`: every user is generated from its own random generator seeded by
+the seed and the user's index, so it doesn't depend on `--jobs` and `--batch-users`. Users are split between
+`--jobs` processes, each copying by its own connection. With `--disable-triggers` foreign keys aren't checked
+during copying (needs a superuser), which makes it about three times faster.
+
+Run from the `api_service` directory against a local Postgres:
+    python -m benchmarks.dataset --users 120000 --years 1 --jobs 8 --disable-triggers
+which generates about 1B activities. Delete the generated users with `--delete`.
+"""
+import argparse
+import asyncio
+import io
+import json
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from typing import Dict, List, Tuple
+
+import asyncpg
+import numpy as np
+
+from config import get_config
+from database.models import ActivityTypes
+from database.partitions import create_actions_partitions
+from database.session_manager import session_manager
+
+# Telegram IDs are far below this, so generated users don't clash with real ones
+FIRST_USER_ID: int = 8_000_000_000_000
+LEISURE_TYPES: List[ActivityTypes] = [
+    ActivityTypes.FAMILY, ActivityTypes.FRIENDS, ActivityTypes.PASSIVE, ActivityTypes.EXERCISE, ActivityTypes.READING,
+]
+DEFAULT_LEISURE_WEIGHTS: str = 'FAMILY=25,FRIENDS=15,PASSIVE=35,EXERCISE=10,READING=15'
+# Labels of `ActivityTypes` by value, value 0 stands for an hour without activity
+TYPE_LABELS = np.array([''] + [activity_type.name for activity_type in ActivityTypes], dtype=object)
+
+
+@dataclass
+class Distributions:
+    """ Parameters of the generated users and their routines. """
+    fill_rate: float
+    work_share: float
+    study_share: float
+    leisure_weights: List[float]
+    tz_mean: float
+    tz_std: float
+    notify_share: float
+
+
+@dataclass
+class UserData:
+    """ CSV lines of rows of one user by table. """
+    user: str
+    notify_schedule: List[str]
+    actions: List[str]
+    activity_days: List[str]
+    rollups: List[str]
+
+
+def get_hours(start: datetime, end: datetime) -> np.ndarray:
+    return np.arange(np.datetime64(start, 'h'), np.datetime64(end, 'h'))
+
+
+def generate_routine(rng: np.random.Generator, local_hours: np.ndarray, dist: Distributions) -> np.ndarray:
+    """
+    Generate activity types (`ActivityTypes` values, 0 for skipped hours) of every local hour.
+
+    :param rng: Random generator of the user.
+    :param local_hours: Local hours, which start at midnight and span whole days.
+    :param dist: Parameters of routines.
+    :return: Array of activity types of the same shape as `local_hours`.
+    """
+    days = len(local_hours) // 24
+    hour_of_day = np.arange(24)
+
+    # Leisure by default, then sleep from around 23 for 7-9 hours, then work or study on weekdays
+    types = np.array([t.value for t in LEISURE_TYPES], dtype=np.int16)[
+        rng.choice(len(LEISURE_TYPES), size=(days, 24), p=dist.leisure_weights)
+    ]
+    bedtime = 23 + rng.integers(-1, 2, size=(days, 1))
+    wake_up = (bedtime + rng.integers(7, 10, size=(days, 1))) % 24
+    is_sleep = (hour_of_day >= bedtime) | (hour_of_day < wake_up)
+    types[is_sleep] = ActivityTypes.SLEEP.value
+
+    occupation = rng.choice(
+        [ActivityTypes.WORK.value, ActivityTypes.STUDYING.value, 0],
+        p=[dist.work_share, dist.study_share, 1 - dist.work_share - dist.study_share],
+    )
+    if occupation:
+        weekdays = (local_hours[::24].astype('datetime64[D]').astype(np.int64) + 3) % 7  # Monday is 0
+        starts = rng.integers(8, 11, size=(days, 1))
+        is_busy = (weekdays[:, None] < 5) & (hour_of_day >= starts) & (hour_of_day < starts + 8)
+        types[is_busy & ~is_sleep] = occupation
+
+    types[rng.random(days) >= dist.fill_rate] = 0
+    return types.reshape(-1)
+
+
+def count_rollups(user_id: int, hours: np.ndarray, types: np.ndarray) -> List[str]:
+    """ Count activities by type for every day, week and month in UTC, like `database.rollups` does. """
+    days = hours.astype('datetime64[D]')
+    weeks = days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    months = hours.astype('datetime64[M]').astype('datetime64[D]')
+    lines = []
+    for period, starts in (('DAY', days), ('WEEK', weeks), ('MONTH', months)):
+        keys, amounts = np.unique(starts.astype(np.int64) * 16 + types, return_counts=True)
+        period_starts = np.datetime_as_string((keys // 16).astype('datetime64[D]')).astype(object)
+        lines.extend(f'{user_id},{period},' + period_starts + ',' + TYPE_LABELS[keys % 16] + ',' + amounts.astype(str))
+    return lines
+
+
+def generate_user(
+        seed: int, user_index: int, start: datetime, end: datetime, dist: Distributions, storage: str
+) -> Tuple[UserData, Dict[str, int]]:
+    """ Generate rows of the user with index `user_index` and count them by table. """
+    rng = np.random.default_rng([seed, user_index])
+    user_id = FIRST_USER_ID + user_index
+    tz_delta = int(np.clip(np.rint(rng.normal(dist.tz_mean, dist.tz_std)), -12, 12))
+
+    # Generate whole local days around the UTC range and keep hours inside of it
+    local_hours = get_hours(start - timedelta(days=1), end + timedelta(days=1))
+    local_hours = local_hours[:len(local_hours) // 24 * 24]
+    types = generate_routine(rng, local_hours, dist)
+    hours = local_hours - np.timedelta64(tz_delta, 'h')
+    is_set = (types > 0) & (hours >= np.datetime64(start, 'h')) & (hours < np.datetime64(end, 'h'))
+    hours, types = hours[is_set], types[is_set]
+
+    notify_hours = []
+    if rng.random() < dist.notify_share:
+        local_notify_hours = rng.choice(np.arange(8, 23), size=rng.integers(1, 4), replace=False)
+        notify_hours = sorted(int(hour - tz_delta) % 24 for hour in local_notify_hours)
+
+    last_activity_time = str(hours[-1].astype('datetime64[s]')) if len(hours) else ''
+    notify_hours_array = '"{' + ','.join(map(str, notify_hours)) + '}"' if notify_hours else ''
+    data = UserData(
+        user=(
+            f'{user_id},dataset_{user_index},en,{start.isoformat()},{last_activity_time or end.isoformat()},'
+            f'{notify_hours_array},{tz_delta},{last_activity_time}'
+        ),
+        notify_schedule=[f'{hour},{user_id}' for hour in notify_hours],
+        actions=[],
+        activity_days=[],
+        rollups=count_rollups(user_id, hours, types),
+    )
+
+    times = np.datetime_as_string(hours).astype(object)
+    if storage in ('rows', 'dual'):
+        data.actions = list(f'{user_id},' + TYPE_LABELS[types] + ',' + times + ':00')
+    if storage in ('grid', 'dual'):
+        days, day_indexes = np.unique(hours.astype('datetime64[D]'), return_inverse=True)
+        slots = np.zeros((len(days), 24), dtype=np.int16)
+        slots[day_indexes, (hours - hours.astype('datetime64[D]')).astype(np.int64)] = types
+        data.activity_days = [
+            f'{user_id},{day},"{{{",".join(map(str, day_slots))}}}"'
+            for day, day_slots in zip(np.datetime_as_string(days), slots.tolist())
+        ]
+
+    return data, {
+        'users': 1,
+        'user_notify_schedule': len(data.notify_schedule),
+        'actions': len(data.actions),
+        'activity_days': len(data.activity_days),
+        'user_activity_rollups': len(data.rollups),
+    }
+
+
+async def copy_lines(connection: asyncpg.Connection, table: str, columns: List[str], lines: List[str]) -> None:
+    if lines:
+        source = io.BytesIO(('\n'.join(lines) + '\n').encode())
+        await connection.copy_to_table(table, source=source, columns=columns, format='csv')
+
+
+async def copy_users(
+        dsn: str, user_indexes: range, seed: int, start: datetime, end: datetime, dist: Distributions,
+        storage: str, batch_users: int, disable_triggers: bool,
+) -> Counter:
+    """ Generate and copy users with `user_indexes`, committing every `batch_users` users. """
+    counts = Counter()
+    connection = await asyncpg.connect(dsn)
+    try:
+        if disable_triggers:
+            await connection.execute('SET session_replication_role = replica')
+        for batch_start in range(user_indexes.start, user_indexes.stop, batch_users):
+            batch = [
+                generate_user(seed, user_index, start, end, dist, storage)
+                for user_index in range(batch_start, min(batch_start + batch_users, user_indexes.stop))
+            ]
+            async with connection.transaction():
+                for table, columns, attribute in (
+                        ('users', ['id', 'username', 'language', 'joined_at', 'last_activity', 'notify_hours',
+                                   'time_zone_delta', 'last_activity_time'], 'user'),
+                        ('user_notify_schedule', ['hour', 'user_id'], 'notify_schedule'),
+                        ('actions', ['user_id', 'type', 'time'], 'actions'),
+                        ('activity_days', ['user_id', 'day', 'slots'], 'activity_days'),
+                        ('user_activity_rollups', ['user_id', 'period', 'period_start', 'type', 'amount'], 'rollups'),
+                ):
+                    lines = [
+                        line
+                        for data, _ in batch
+                        for line in ([data.user] if attribute == 'user' else getattr(data, attribute))
+                    ]
+                    await copy_lines(connection, table, columns, lines)
+            for _, user_counts in batch:
+                counts.update(user_counts)
+    finally:
+        await connection.close()
+    return counts
+
+
+def run_job(args: tuple) -> Counter:
+    return asyncio.run(copy_users(*args))
+
+
+async def prepare(start: datetime) -> None:
+    """ Create partitions of `actions` for the whole range of the dataset. """
+    session_manager.init()
+    async with session_manager.create_connect() as connection:
+        await create_actions_partitions(connection, months_ahead=3, from_date=start.date())
+    await session_manager.close()
+
+
+async def finish(dsn: str, delete: bool) -> None:
+    connection = await asyncpg.connect(dsn)
+    try:
+        if delete:
+            for table in ('user_activity_rollups', 'activity_days', 'actions', 'user_notify_schedule'):
+                await connection.execute(f'DELETE FROM {table} WHERE user_id >= $1', FIRST_USER_ID)
+            await connection.execute('DELETE FROM users WHERE id >= $1', FIRST_USER_ID)
+        else:
+            await connection.execute('ANALYZE')
+    finally:
+        await connection.close()
+
+
+def main(args: argparse.Namespace) -> None:
+    config = get_config()
+    dsn = config.db.url.replace('postgresql+asyncpg', 'postgresql')
+    if args.delete:
+        asyncio.run(finish(dsn, delete=True))
+        return
+
+    leisure = dict(item.split('=') for item in args.leisure_weights.split(','))
+    weights = np.array([float(leisure.get(activity_type.name, 0)) for activity_type in LEISURE_TYPES])
+    dist = Distributions(
+        fill_rate=args.fill_rate,
+        work_share=args.work_share,
+        study_share=args.study_share,
+        leisure_weights=list(weights / weights.sum()),
+        tz_mean=args.tz_mean,
+        tz_std=args.tz_std,
+        notify_share=args.notify_share,
+    )
+    end = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    start = (end - timedelta(days=round(365.25 * args.years))).replace(hour=0)
+    storage = config.db.activity_storage
+
+    started_at = time.perf_counter()
+    asyncio.run(prepare(start))
+    share = -(-args.users // args.jobs)
+    jobs = [
+        (dsn, range(job_start, min(job_start + share, args.users)), args.seed, start, end, dist, storage,
+         args.batch_users, args.disable_triggers)
+        for job_start in range(0, args.users, share)
+    ]
+    with Pool(len(jobs)) as pool:
+        counts = sum(pool.imap_unordered(run_job, jobs), Counter())
+    copy_seconds = time.perf_counter() - started_at
+    asyncio.run(finish(dsn, delete=False))
+
+    print(json.dumps({
+        'seed': args.seed,
+        'storage': storage,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'rows': dict(counts),
+        'copy_seconds': copy_seconds,
+        'total_seconds': time.perf_counter() - started_at,
+        'rows_per_second': sum(counts.values()) / copy_seconds,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000, help='Amount of generated users.')
+    parser.add_argument('--years', type=float, default=1, help='Years of activities up to the current hour.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the dataset.')
+    parser.add_argument('--jobs', type=int, default=1, help='Amount of processes copying users in parallel.')
+    parser.add_argument('--batch-users', type=int, default=20, help='Amount of users copied per transaction.')
+    parser.add_argument('--disable-triggers', action='store_true',
+                        help="Don't check foreign keys while copying (needs a superuser).")
+    parser.add_argument('--fill-rate', type=float, default=0.8, help='Share of days which users fill.')
+    parser.add_argument('--work-share', type=float, default=0.6, help='Share of users who work on weekdays.')
+    parser.add_argument('--study-share', type=float, default=0.2, help='Share of users who study on weekdays.')
+    parser.add_argument('--leisure-weights', default=DEFAULT_LEISURE_WEIGHTS,
+                        help='Weights of leisure activities in free hours like "PASSIVE=35,READING=15".')
+    parser.add_argument('--tz-mean', type=float, default=3, help='Mean of users\' time zone deltas in hours.')
+    parser.add_argument('--tz-std', type=float, default=2, help='Standard deviation of time zone deltas.')
+    parser.add_argument('--notify-share', type=float, default=0.5, help='Share of users with notify hours.')
+    parser.add_argument('--delete', action='store_true', help='Delete the generated users instead.')
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,101 @@
+"""
+Memory benchmark of the activities export.
+
+Creates temporary users with different amounts of hourly activities, then consumes the streamed export of every
+user and the naive "load everything with `.all()`" export, recording peak Python memory with `tracemalloc`.
+The peak of the streamed export should stay flat as the history grows.
+
+Run from the `api_service` directory:
+    python -m benchmarks.export_memory --sizes 10 1000 100000
+"""
+import argparse
+import asyncio
+import json
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import delete, select
+
+import schemas
+from database.models import User, Activity, ActivityRollup, ActivityDay, ActivityTypes
+from database.repositories import DatabaseRepo
+from database.session_manager import session_manager
+from routers.users import stream_activities_export
+
+# Telegram IDs are far below this, so benchmark users don't clash with real ones
+FIRST_USER_ID: int = 9_000_000_000_000
+
+
+async def create_user(user_id: int, activities_amount: int) -> None:
+    """ Create user with `activities_amount` hourly activities going back from the current hour. """
+    now = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+    activity_types = list(ActivityTypes)
+    activities = [
+        schemas.ActivityBase(type=activity_types[hour % len(activity_types)], time=now - timedelta(hours=hour + 1))
+        for hour in range(activities_amount)
+    ]
+    async with session_manager.create_session() as session:
+        db = DatabaseRepo(session)
+        await db.users.create_or_update(user_id=user_id, language='en', username=f'bench_{user_id}')
+        await db.users.add_activities(user_id, activities)
+
+
+async def delete_users(user_ids: List[int]) -> None:
+    async with session_manager.create_session() as session:
+        for model in (ActivityRollup, ActivityDay, Activity):
+            await session.execute(delete(model).where(model.user_id.in_(user_ids)))
+        await session.execute(delete(User).where(User.id.in_(user_ids)))
+        await session.commit()
+
+
+async def measure_streamed(user_id: int) -> dict:
+    tracemalloc.start()
+    exported_bytes = 0
+    async for chunk in stream_activities_export(user_id, schemas.ExportFormat.NDJSON):
+        exported_bytes += len(chunk)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"exported_bytes": exported_bytes, "peak_memory_bytes": peak}
+
+
+async def measure_naive(user_id: int) -> dict:
+    tracemalloc.start()
+    async with session_manager.create_session() as session:
+        rows = (await session.execute(
+            select(Activity.time, Activity.type).where(Activity.user_id == user_id).order_by(Activity.time)
+        )).all()
+        body = ''.join(
+            json.dumps({'time': time.isoformat(), 'type': activity_type.name}) + '\n' for time, activity_type in rows
+        )
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"exported_bytes": len(body), "peak_memory_bytes": peak}
+
+
+async def main(sizes: List[int]) -> None:
+    user_ids = [FIRST_USER_ID + i for i in range(len(sizes))]
+    session_manager.init()
+    results = []
+    try:
+        for user_id, size in zip(user_ids, sizes):
+            await create_user(user_id, size)
+            results.append({
+                "activities": size,
+                "streamed": await measure_streamed(user_id),
+                "naive": await measure_naive(user_id),
+            })
+    finally:
+        await delete_users(user_ids)
+        await session_manager.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100_000],
+                        help='Amounts of activities of benchmark users.')
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sizes))
@@ -0,0 +1,119 @@
+"""
+Benchmark of the "last activity" lookup on a synthetic actions table.
+
+Compares the old query (`ORDER BY time DESC` over the whole user's history without an index) with the new one
+(seek by the denormalized `users.last_activity_time` through the `(user_id, time DESC)` index).
+The data is generated into separate unlogged `bench_*` tables, so the real tables are never touched.
+
+Run from the `api_service` directory:
+    python -m benchmarks.last_activity --rows 100000000 --users 10000
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection
+
+from config import get_config
+
+OLD_QUERY = text(
+    "SELECT id, user_id, type, time FROM bench_actions WHERE user_id = :user_id ORDER BY time DESC"
+)
+NEW_QUERY = text(
+    "SELECT id, user_id, type, time FROM bench_actions "
+    "WHERE user_id = :user_id "
+    "AND time = (SELECT last_activity_time FROM bench_users WHERE id = :user_id) "
+    "LIMIT 1"
+)
+
+
+async def fill_tables(conn: AsyncConnection, rows: int, users: int) -> None:
+    """ Create unlogged bench tables and fill them with `rows` hourly activities spread across `users`. """
+    hours_per_user = rows // users
+    await conn.execute(text("DROP TABLE IF EXISTS bench_actions, bench_users"))
+    await conn.execute(text(
+        "CREATE UNLOGGED TABLE bench_actions "
+        "(id BIGSERIAL PRIMARY KEY, user_id BIGINT NOT NULL, type SMALLINT NOT NULL, time TIMESTAMP NOT NULL)"
+    ))
+    await conn.execute(text(
+        "INSERT INTO bench_actions (user_id, type, time) "
+        "SELECT u, 1 + (random() * 7)::int, TIMESTAMP '2000-01-01' + h * INTERVAL '1 hour' "
+        "FROM generate_series(1, :hours) AS h, generate_series(1, :users) AS u"
+    ), {"hours": hours_per_user, "users": users})
+    await conn.execute(text("ANALYZE bench_actions"))
+
+
+async def create_new_schema(conn: AsyncConnection) -> None:
+    """ Add the composite index and the denormalized last activity time, as the migration does. """
+    await conn.execute(text("CREATE INDEX ON bench_actions (user_id, time DESC)"))
+    await conn.execute(text(
+        "CREATE UNLOGGED TABLE bench_users AS "
+        "SELECT user_id AS id, MAX(time) AS last_activity_time FROM bench_actions GROUP BY user_id"
+    ))
+    await conn.execute(text("ALTER TABLE bench_users ADD PRIMARY KEY (id)"))
+    await conn.execute(text("ANALYZE bench_actions, bench_users"))
+
+
+async def measure(conn: AsyncConnection, query, user_ids: List[int]) -> dict:
+    """ Run `query` for every user from `user_ids` fetching only the first row, return timings in ms. """
+    timings = []
+    for user_id in user_ids:
+        start = time.perf_counter()
+        result = await conn.execute(query, {"user_id": user_id})
+        result.first()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "calls": len(timings),
+        "mean_ms": statistics.mean(timings),
+        "median_ms": statistics.median(timings),
+        "max_ms": max(timings),
+    }
+
+
+async def main(rows: int, users: int, samples: int, old_samples: int, keep: bool) -> None:
+    engine = create_async_engine(get_config().db.url)
+    sample_ids = random.Random(0).sample(range(1, users + 1), k=min(samples, users))
+
+    async with engine.begin() as conn:
+        start = time.perf_counter()
+        await fill_tables(conn, rows, users)
+        fill_seconds = time.perf_counter() - start
+
+    async with engine.connect() as conn:
+        old = await measure(conn, OLD_QUERY, sample_ids[:old_samples])
+
+    async with engine.begin() as conn:
+        await create_new_schema(conn)
+
+    async with engine.connect() as conn:
+        new = await measure(conn, NEW_QUERY, sample_ids)
+
+        if not keep:
+            await conn.execute(text("DROP TABLE IF EXISTS bench_actions, bench_users"))
+            await conn.commit()
+    await engine.dispose()
+
+    print(json.dumps({
+        "rows": rows,
+        "users": users,
+        "fill_seconds": fill_seconds,
+        "old_query": old,
+        "new_query": new,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100_000_000, help='Total amount of synthetic activities.')
+    parser.add_argument('--users', type=int, default=10_000, help='Amount of users to spread activities across.')
+    parser.add_argument('--samples', type=int, default=1000, help='Amount of lookups with the new query.')
+    parser.add_argument('--old-samples', type=int, default=5, help='Amount of lookups with the old query.')
+    parser.add_argument('--keep', action='store_true', help="Don't drop bench tables after run.")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.rows, args.users, args.samples, args.old_samples, args.keep))
@@ -0,0 +1,260 @@
+"""
+End-to-end load benchmark of a running api_service, replaying the traffic mix of the bot.
+
+Every virtual client repeatedly picks a random user and a scenario by weight, like the bot does on an update:
+    message       - `PUT /users`, which the bot middleware sends on every update
+    set_activity  - upsert, `GET /users/{id}/context` on dialog start, upsert and batch `POST /users/{id}/activities`
+    settings      - upsert, `GET /users/{id}/context` on dialog start, upsert and `PUT` of notify hours or tz delta
+    summary       - upsert and `GET /users/{id}/activities/summary`
+Besides, every `--notify-every` seconds `GET /users/to_notify` is sent and the returned users start /set_activity
+at once, like after the hourly notification.
+
+Benchmark users are created by `PUT /users/batch` before the run and deleted from the database after it.
+Throughput and p50/p95/p99 latencies per endpoint are printed as JSON, so runs can be compared across commits.
+
+Run from the `api_service` directory against a local Postgres, with the API started by `python app.py`:
+    python -m benchmarks.load --base-url http://127.0.0.1:8000 --users 10000 --clients 50 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+from sqlalchemy import delete
+
+from database.models import User, Activity, ActivityRollup, ActivityDay, NotifySchedule, ActivityTypes
+from database.session_manager import session_manager
+
+# Telegram IDs are far below this, so benchmark users don't clash with real ones
+FIRST_USER_ID: int = 9_200_000_000_000
+BATCH_SIZE: int = 10_000
+DEFAULT_MIX: str = 'message=50,set_activity=20,settings=5,summary=25'
+
+
+def percentile(sorted_values: List[float], percent: float) -> float:
+    """ Return percentile of sorted values by the nearest-rank method. """
+    index = max(int(len(sorted_values) * percent / 100 + 0.5) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+def get_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, users: int, mix: Dict[str, int], notify_share: float, seed: int):
+        self.client = client
+        self.user_ids = [FIRST_USER_ID + i for i in range(users)]
+        self.notify_share = notify_share
+        self.random = random.Random(seed)
+        self.scenarios = [getattr(self, f'scenario_{name}') for name in mix]
+        self.weights = list(mix.values())
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        # Time of the next activity to post by user, going from the past to the current hour
+        start = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(days=365)
+        self.next_activity_time: Dict[int, datetime] = {user_id: start for user_id in self.user_ids}
+
+    async def request(self, name: str, method: str, url: str, **kwargs) -> Optional[httpx.Response]:
+        """ Send request and record its latency under endpoint `name`. """
+        started_at = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[name] += 1
+            return None
+        self.latencies[name].append(time.perf_counter() - started_at)
+        if response.is_error:
+            self.errors[name] += 1
+        return response
+
+    async def upsert(self, user_id: int) -> None:
+        await self.request('PUT /users', 'PUT', '/users', json={
+            'id': user_id, 'username': f'load_{user_id}', 'language': 'en',
+        })
+
+    async def setup(self) -> None:
+        """ Create benchmark users and set notify hours in the current hour of `notify_share` of them. """
+        for chunk_start in range(0, len(self.user_ids), BATCH_SIZE):
+            users = [
+                {'id': user_id, 'username': f'load_{user_id}', 'language': 'en'}
+                for user_id in self.user_ids[chunk_start:chunk_start + BATCH_SIZE]
+            ]
+            response = await self.client.put('/users/batch', json={'users': users})
+            response.raise_for_status()
+
+        notify_hours = [datetime.utcnow().hour]
+        notified = self.random.sample(self.user_ids, int(len(self.user_ids) * self.notify_share))
+        for chunk_start in range(0, len(notified), 100):
+            await asyncio.gather(*(
+                self.client.put(f'/users/{user_id}/notify_hours', json={'notify_hours': notify_hours})
+                for user_id in notified[chunk_start:chunk_start + 100]
+            ))
+
+    async def scenario_message(self, user_id: int) -> None:
+        await self.upsert(user_id)
+
+    async def scenario_set_activity(self, user_id: int) -> None:
+        await self.upsert(user_id)
+        await self.request('GET /users/{id}/context', 'GET', f'/users/{user_id}/context')
+        await self.upsert(user_id)
+
+        hours = self.random.randint(1, 8)
+        times = [self.next_activity_time[user_id] + timedelta(hours=hour) for hour in range(hours)]
+        self.next_activity_time[user_id] = times[-1] + timedelta(hours=1)
+        activities = [
+            {'type': self.random.choice(list(ActivityTypes)).value, 'time': activity_time.isoformat()}
+            for activity_time in times
+            if activity_time < datetime.utcnow()
+        ]
+        if activities:
+            await self.request('POST /users/{id}/activities', 'POST', f'/users/{user_id}/activities', json={
+                'activities': activities,
+            })
+
+    async def scenario_settings(self, user_id: int) -> None:
+        await self.upsert(user_id)
+        await self.request('GET /users/{id}/context', 'GET', f'/users/{user_id}/context')
+        await self.upsert(user_id)
+        if self.random.random() < 0.5:
+            notify_hours = sorted(self.random.sample(range(24), self.random.randint(1, 4)))
+            await self.request('PUT /users/{id}/notify_hours', 'PUT', f'/users/{user_id}/notify_hours', json={
+                'notify_hours': notify_hours,
+            })
+        else:
+            await self.request('PUT /users/{id}/tz_delta', 'PUT', f'/users/{user_id}/tz_delta', json={
+                'tz_delta': self.random.randint(-12, 12),
+            })
+
+    async def scenario_summary(self, user_id: int) -> None:
+        await self.upsert(user_id)
+        await self.request('GET /users/{id}/activities/summary', 'GET', f'/users/{user_id}/activities/summary')
+
+    async def run_client(self, deadline: float) -> None:
+        while time.perf_counter() < deadline:
+            scenario = self.random.choices(self.scenarios, self.weights)[0]
+            await scenario(self.random.choice(self.user_ids))
+
+    async def run_notifications(self, deadline: float, notify_every: float, clients: int) -> None:
+        """ Send the hourly to_notify request and start /set_activity of notified users with `clients` at once. """
+        while time.perf_counter() + notify_every < deadline:
+            await asyncio.sleep(notify_every)
+            response = await self.request('GET /users/to_notify', 'GET', '/users/to_notify')
+            if response is None or response.is_error:
+                continue
+
+            user_ids = [user_id for user_id in response.json()['user_ids'] if user_id >= FIRST_USER_ID]
+            semaphore = asyncio.Semaphore(clients)
+
+            async def set_activity(user_id: int) -> None:
+                async with semaphore:
+                    await self.scenario_set_activity(user_id)
+
+            await asyncio.gather(*(set_activity(user_id) for user_id in user_ids))
+
+    async def run(self, clients: int, duration: float, notify_every: float) -> float:
+        """ Run clients and notifications for `duration` seconds. Return the actual duration. """
+        started_at = time.perf_counter()
+        deadline = started_at + duration
+        await asyncio.gather(
+            *(self.run_client(deadline) for _ in range(clients)),
+            self.run_notifications(deadline, notify_every, clients),
+        )
+        return time.perf_counter() - started_at
+
+    def report(self, duration: float) -> dict:
+        endpoints = {}
+        for name in sorted(self.latencies.keys() | self.errors.keys()):
+            latencies = sorted(self.latencies[name])
+            endpoints[name] = {
+                'requests': len(latencies),
+                'errors': self.errors[name],
+                'throughput_rps': len(latencies) / duration,
+                **({
+                    'p50_ms': percentile(latencies, 50) * 1000,
+                    'p95_ms': percentile(latencies, 95) * 1000,
+                    'p99_ms': percentile(latencies, 99) * 1000,
+                    'max_ms': latencies[-1] * 1000,
+                } if latencies else {}),
+            }
+        requests = sum(endpoint['requests'] for endpoint in endpoints.values())
+        return {
+            'duration_seconds': duration,
+            'requests': requests,
+            'errors': sum(self.errors.values()),
+            'throughput_rps': requests / duration,
+            'endpoints': endpoints,
+        }
+
+
+async def delete_users(from_id: int) -> None:
+    session_manager.init()
+    async with session_manager.create_session() as session:
+        for model in (ActivityRollup, ActivityDay, Activity, NotifySchedule):
+            await session.execute(delete(model).where(model.user_id >= from_id))
+        await session.execute(delete(User).where(User.id >= from_id))
+        await session.commit()
+    await session_manager.close()
+
+
+async def main(args: argparse.Namespace) -> None:
+    mix = {name: int(weight) for name, weight in (item.split('=') for item in args.mix.split(','))}
+    limits = httpx.Limits(max_connections=args.clients + 1, max_keepalive_connections=args.clients + 1)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        generator = LoadGenerator(client, args.users, mix, args.notify_share, args.seed)
+        try:
+            await generator.setup()
+            duration = await generator.run(args.clients, args.duration, args.notify_every)
+        finally:
+            if not args.keep_users:
+                await delete_users(FIRST_USER_ID)
+
+    result = {
+        'commit': get_commit(),
+        'config': {
+            'users': args.users,
+            'clients': args.clients,
+            'duration': args.duration,
+            'mix': mix,
+            'notify_every': args.notify_every,
+            'notify_share': args.notify_share,
+            'seed': args.seed,
+        },
+        **generator.report(duration),
+    }
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='URL of the running API.')
+    parser.add_argument('--users', type=int, default=10_000, help='Amount of benchmark users.')
+    parser.add_argument('--clients', type=int, default=50, help='Amount of concurrent virtual clients.')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds of the run.')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Weights of scenarios like "message=50,summary=25".')
+    parser.add_argument('--notify-every', type=float, default=20,
+                        help='Seconds between to_notify bursts, which stand for hours of the real traffic.')
+    parser.add_argument('--notify-share', type=float, default=0.1,
+                        help='Share of users who are notified in the current hour.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of random choices of users and scenarios.')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for a response.')
+    parser.add_argument('--output', help='File to write the JSON result to, besides stdout.')
+    parser.add_argument('--keep-users', action='store_true', help="Don't delete benchmark users after the run.")
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,163 @@
+"""
+Micro-benchmark of response serialization of hot endpoints.
+
+For every endpoint compares the way it was serialized before (building the response model from the database
+row, FastAPI's response model validation, `jsonable_encoder` and stdlib `JSONResponse`) with the direct one
+(a dict from `serializers` encoded by `ORJSONResponse`). No database is needed.
+
+Run from the `api_service` directory:
+    python -m benchmarks.serialization --calls 20000
+"""
+import argparse
+import json
+import timeit
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Callable, Dict, Tuple, Any, Coroutine
+
+from fastapi._compat import ModelField
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+
+import schemas
+import serializers
+from database.models import User, Activity, ActivityTypes
+
+NOW = datetime(2026, 10, 17, 12)
+USER = User(id=123456789, username='username', language='en', notify_hours=[9, 13, 21], time_zone_delta=3)
+ACTIVITY = Activity(id=42, user_id=USER.id, type=ActivityTypes.WORK, time=NOW - timedelta(hours=1))
+SUMMARY = [(activity_type, 100 + activity_type.value) for activity_type in ActivityTypes]
+USER_IDS = list(range(1000))
+HOURS_TO_SUBMIT = list(range(9, 15))
+
+
+def run(coroutine: Coroutine) -> Any:
+    """ Run coroutine which doesn't wait for anything without an event loop. """
+    try:
+        coroutine.send(None)
+    except StopIteration as result:
+        return result.value
+    raise RuntimeError('Coroutine is waiting for something')
+
+
+@lru_cache
+def get_response_field(response_model: Any) -> ModelField:
+    """ FastAPI creates the response field once per route. """
+    return create_model_field(name='Response', type_=response_model, mode='serialization')
+
+
+def response_model_body(response_model: Any, content: Any) -> bytes:
+    """ Serialize returned value like FastAPI does for endpoints with a response model. """
+    field = get_response_field(response_model)
+    return JSONResponse(jsonable_encoder(run(serialize_response(field=field, response_content=content)))).body
+
+
+def old_create_or_update() -> bytes:
+    return JSONResponse(schemas.UserOut.model_validate(USER, from_attributes=True).model_dump(by_alias=True)).body
+
+
+def new_create_or_update() -> bytes:
+    return ORJSONResponse(serializers.dump_user(USER)).body
+
+
+def old_get_users_to_notify() -> bytes:
+    return response_model_body(schemas.UsersToNotifyOut, schemas.UsersToNotifyOut(user_ids=USER_IDS))
+
+
+def new_get_users_to_notify() -> bytes:
+    return ORJSONResponse({'user_ids': USER_IDS}).body
+
+
+def old_get_notify_hours() -> bytes:
+    return response_model_body(schemas.UserNotifyHoursOut, schemas.UserNotifyHoursOut(notify_hours=USER.notify_hours))
+
+
+def new_get_notify_hours() -> bytes:
+    return ORJSONResponse({'notify_hours': USER.notify_hours}).body
+
+
+def old_get_time_zone_delta() -> bytes:
+    return response_model_body(
+        schemas.UserTimeZoneDeltaOut, schemas.UserTimeZoneDeltaOut(tz_delta=USER.time_zone_delta)
+    )
+
+
+def new_get_time_zone_delta() -> bytes:
+    return ORJSONResponse({'tz_delta': USER.time_zone_delta}).body
+
+
+def old_get_last_activity() -> bytes:
+    return response_model_body(schemas.LastActivityOut, schemas.LastActivityOut.model_validate(ACTIVITY))
+
+
+def new_get_last_activity() -> bytes:
+    return ORJSONResponse(serializers.dump_activity(ACTIVITY)).body
+
+
+def old_get_activity_summary() -> bytes:
+    return response_model_body(schemas.UserActivitiesSummaryOut, schemas.UserActivitiesSummaryOut(
+        data=[
+            schemas.UserActivitySummary(type_id=activity_type, type_name=activity_type.name, amount=amount)
+            for activity_type, amount in SUMMARY
+        ]
+    ))
+
+
+def new_get_activity_summary() -> bytes:
+    return ORJSONResponse({'data': serializers.dump_summary(SUMMARY)}).body
+
+
+def old_get_context() -> bytes:
+    return response_model_body(schemas.UserContextOut, schemas.UserContextOut(
+        tz_delta=USER.time_zone_delta,
+        notify_hours=USER.notify_hours,
+        last_activity=schemas.LastActivityOut.model_validate(ACTIVITY),
+        current_hour=NOW,
+        hours_to_submit=HOURS_TO_SUBMIT,
+    ))
+
+
+def new_get_context() -> bytes:
+    return ORJSONResponse({
+        'tz_delta': USER.time_zone_delta,
+        'notify_hours': USER.notify_hours,
+        'last_activity': serializers.dump_activity(ACTIVITY),
+        'current_hour': NOW,
+        'hours_to_submit': HOURS_TO_SUBMIT,
+    }).body
+
+
+ENDPOINTS: Dict[str, Tuple[Callable[[], bytes], Callable[[], bytes]]] = {
+    'PUT /users': (old_create_or_update, new_create_or_update),
+    'GET /users/to_notify': (old_get_users_to_notify, new_get_users_to_notify),
+    'GET /users/{id}/notify_hours': (old_get_notify_hours, new_get_notify_hours),
+    'GET /users/{id}/tz_delta': (old_get_time_zone_delta, new_get_time_zone_delta),
+    'GET /users/{id}/activities/last': (old_get_last_activity, new_get_last_activity),
+    'GET /users/{id}/activities/summary': (old_get_activity_summary, new_get_activity_summary),
+    'GET /users/{id}/context': (old_get_context, new_get_context),
+}
+
+
+def measure(serialize: Callable[[], bytes], calls: int) -> float:
+    """ Return mean microseconds per serialization. """
+    serialize()
+    return timeit.timeit(serialize, number=calls) / calls * 1_000_000
+
+
+def main(calls: int) -> None:
+    results = {}
+    for name, (old, new) in ENDPOINTS.items():
+        assert json.loads(old()) == json.loads(new()), f'Bodies of {name} differ'
+        old_us, new_us = measure(old, calls), measure(new, calls)
+        results[name] = {"model_us": old_us, "direct_us": new_us, "speedup": old_us / new_us}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20000, help='Amount of serializations per endpoint.')
+    args = parser.parse_args()
+
+    main(args.calls)
@@ -0,0 +1,123 @@
+"""
+Micro-benchmark of per-call statement overhead of `UserRepo` hot-path methods.
+
+On every `session.execute()` SQLAlchemy builds the statement and generates its cache key to find the compiled SQL.
+This compares that work for plain constructs, as the repository built them before, and for `lambda_stmt` ones.
+No database is needed.
+
+Run from the `api_service` directory:
+    python -m benchmarks.statement_overhead --calls 20000
+"""
+import argparse
+import json
+import timeit
+from typing import Callable, Dict, Tuple
+
+from sqlalchemy import select, lambda_stmt
+from sqlalchemy.dialects.postgresql import insert
+
+from database.func import utcnow
+from database.models import User, Activity, NotifySchedule
+
+USER_ID, HOUR, USERNAME, LANGUAGE = 123456789, 12, 'username', 'en'
+
+
+def plain_create_or_update():
+    return (
+        insert(User)
+        .values(id=USER_ID, username=USERNAME, language=LANGUAGE)
+        .on_conflict_do_update(
+            index_elements=[User.id],
+            set_=dict(username=USERNAME, language=LANGUAGE, last_activity=utcnow()),
+        )
+        .returning(User, (User.joined_at == User.last_activity).label("is_created"))
+    )
+
+
+def lambda_create_or_update():
+    user_id, username, language = USER_ID, USERNAME, LANGUAGE
+    stmt = lambda_stmt(lambda: insert(User).values(id=user_id, username=username, language=language))
+    stmt += lambda s: s.on_conflict_do_update(
+        index_elements=[User.id],
+        set_=dict(username=s.excluded.username, language=s.excluded.language, last_activity=utcnow()),
+    )
+    stmt += lambda s: s.returning(
+        User.id, User.username, User.language, User.notify_hours, User.time_zone_delta,
+        (User.joined_at == User.last_activity).label("is_created"),
+    )
+    return stmt
+
+
+def plain_get_tz_delta():
+    return select(User.time_zone_delta).where(User.id == USER_ID)
+
+
+def lambda_get_tz_delta():
+    user_id = USER_ID
+    return lambda_stmt(lambda: select(User.time_zone_delta).where(User.id == user_id))
+
+
+def plain_get_notify_hours():
+    return select(User.notify_hours).where(User.id == USER_ID)
+
+
+def lambda_get_notify_hours():
+    user_id = USER_ID
+    return lambda_stmt(lambda: select(User.notify_hours).where(User.id == user_id))
+
+
+def plain_get_last_activity():
+    last_activity_time = select(User.last_activity_time).where(User.id == USER_ID).scalar_subquery()
+    return select(Activity).where(Activity.user_id == USER_ID, Activity.time == last_activity_time).limit(1)
+
+
+def lambda_get_last_activity():
+    user_id = USER_ID
+    return lambda_stmt(lambda: (
+        select(Activity)
+        .where(
+            Activity.user_id == user_id,
+            Activity.time == select(User.last_activity_time).where(User.id == user_id).scalar_subquery(),
+        )
+        .limit(1)
+    ))
+
+
+def plain_get_ids_to_notify():
+    return select(NotifySchedule.user_id).where(NotifySchedule.hour == HOUR)
+
+
+def lambda_get_ids_to_notify():
+    hour = HOUR
+    return lambda_stmt(lambda: select(NotifySchedule.user_id).where(NotifySchedule.hour == hour))
+
+
+STATEMENTS: Dict[str, Tuple[Callable, Callable]] = {
+    'create_or_update': (plain_create_or_update, lambda_create_or_update),
+    'get_tz_delta': (plain_get_tz_delta, lambda_get_tz_delta),
+    'get_notify_hours': (plain_get_notify_hours, lambda_get_notify_hours),
+    'get_last_activity': (plain_get_last_activity, lambda_get_last_activity),
+    'get_ids_to_notify': (plain_get_ids_to_notify, lambda_get_ids_to_notify),
+}
+
+
+def measure(build: Callable, calls: int) -> float:
+    """ Return mean microseconds per building the statement and generating its cache key. """
+    build()._generate_cache_key()  # The first call of lambda statement analyzes the lambda, don't count it
+    return timeit.timeit(lambda: build()._generate_cache_key(), number=calls) / calls * 1_000_000
+
+
+def main(calls: int) -> None:
+    results = {}
+    for name, (plain, cached) in STATEMENTS.items():
+        plain_us, cached_us = measure(plain, calls), measure(cached, calls)
+        results[name] = {"plain_us": plain_us, "lambda_us": cached_us, "speedup": plain_us / cached_us}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=20000, help='Amount of calls per statement.')
+    args = parser.parse_args()
+
+    main(args.calls)
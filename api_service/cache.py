@@ -0,0 +1,182 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, Counter
+from functools import lru_cache
+from typing import Any, Optional, Tuple, Dict
+
+from config import get_config, CacheConfig
+
+# Returned by `CacheBackend.get` when there is no value, because `None` is a value which can be cached too
+MISSING = object()
+# Stored by `MemoryCache` under invalidated keys
+TOMBSTONE = object()
+
+
+class CacheStats:
+    """ Hit, miss and invalidation counters of cache, grouped by the kind of cached data """
+
+    def __init__(self):
+        self.hits: Counter[str] = Counter()
+        self.misses: Counter[str] = Counter()
+        self.invalidations: Counter[str] = Counter()
+
+    def as_dict(self) -> Dict[str, Dict[str, int]]:
+        kinds = sorted(self.hits.keys() | self.misses.keys() | self.invalidations.keys())
+        return {
+            kind: {
+                'hits': self.hits[kind],
+                'misses': self.misses[kind],
+                'invalidations': self.invalidations[kind],
+            }
+            for kind in kinds
+        }
+
+
+class CacheBackend(ABC):
+    """
+    Base class of cache storages. Values have to be JSON serializable.
+
+    Invalidated keys keep a tombstone for `invalidation_ttl` seconds, which is read as a missing value, but
+    isn't replaced by `refill`. So a value read from the database before a write and cached after the write
+    is invalidated is dropped instead of being returned until its TTL expires.
+    """
+
+    def __init__(self, ttl: float, invalidation_ttl: float):
+        self.ttl = ttl
+        self.invalidation_ttl = invalidation_ttl
+        self.stats = CacheStats()
+
+    @staticmethod
+    def get_kind(key: str) -> str:
+        """ Return the kind of cached data from key like "user:<user_id>:<kind>" """
+        return key.rsplit(':', 1)[-1]
+
+    async def get(self, key: str) -> Any:
+        """ Return cached value of `key` or `MISSING`, counting hits and misses. """
+        value = await self._get(key)
+        if value is MISSING:
+            self.stats.misses[self.get_kind(key)] += 1
+        else:
+            self.stats.hits[self.get_kind(key)] += 1
+        return value
+
+    async def delete(self, *keys: str) -> None:
+        """ Invalidate cached values of `keys`, leaving tombstones in their place. """
+        for key in keys:
+            self.stats.invalidations[self.get_kind(key)] += 1
+        await self._delete(*keys)
+
+    @abstractmethod
+    async def _get(self, key: str) -> Any:
+        pass
+
+    @abstractmethod
+    async def set(self, key: str, value: Any) -> None:
+        pass
+
+    @abstractmethod
+    async def refill(self, key: str, value: Any) -> None:
+        """ Cache a value read from the database, unless `key` holds a tombstone of a recent invalidation. """
+        pass
+
+    @abstractmethod
+    async def _delete(self, *keys: str) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryCache(CacheBackend):
+    """
+    In-process LRU cache with TTL. Every worker has its own cache, so it can be used only with one worker
+    (see `Config.check_cache_is_shared`).
+    """
+
+    def __init__(self, ttl: float, invalidation_ttl: float, max_size: int):
+        super().__init__(ttl, invalidation_ttl)
+        self.max_size = max_size
+        self._values: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+
+    async def _get(self, key: str) -> Any:
+        expires_at, value = self._values.get(key, (0, MISSING))
+        if expires_at < time.monotonic():
+            self._values.pop(key, None)
+            return MISSING
+        self._values.move_to_end(key)
+        return MISSING if value is TOMBSTONE else value
+
+    def _store(self, key: str, value: Any, ttl: float) -> None:
+        self._values[key] = (time.monotonic() + ttl, value)
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+    async def set(self, key: str, value: Any) -> None:
+        self._store(key, value, self.ttl)
+
+    async def refill(self, key: str, value: Any) -> None:
+        expires_at, cached = self._values.get(key, (0, MISSING))
+        if cached is not TOMBSTONE or expires_at < time.monotonic():
+            self._store(key, value, self.ttl)
+
+    async def _delete(self, *keys: str) -> None:
+        for key in keys:
+            self._store(key, TOMBSTONE, self.invalidation_ttl)
+
+
+class RedisCache(CacheBackend):
+    """ Cache in Redis, shared by all workers. Requires `redis` package. """
+
+    # Stored under invalidated keys, it isn't valid JSON, so it can't be a cached value
+    TOMBSTONE: bytes = b'invalidated'
+    # Checks the tombstone and sets the value in one step, so an invalidation can't happen in between
+    REFILL_SCRIPT: str = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then
+            return 0
+        end
+        redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+        return 1
+    """
+
+    def __init__(self, ttl: float, invalidation_ttl: float, url: str):
+        from redis.asyncio import Redis
+
+        super().__init__(ttl, invalidation_ttl)
+        self._redis = Redis.from_url(url)
+        self._refill = self._redis.register_script(self.REFILL_SCRIPT)
+
+    async def _get(self, key: str) -> Any:
+        value = await self._redis.get(key)
+        return MISSING if value is None or value == self.TOMBSTONE else json.loads(value)
+
+    async def set(self, key: str, value: Any) -> None:
+        await self._redis.set(key, json.dumps(value), px=int(self.ttl * 1000))
+
+    async def refill(self, key: str, value: Any) -> None:
+        await self._refill(keys=[key], args=[self.TOMBSTONE, json.dumps(value), int(self.ttl * 1000)])
+
+    async def _delete(self, *keys: str) -> None:
+        async with self._redis.pipeline(transaction=False) as pipeline:
+            for key in keys:
+                pipeline.set(key, self.TOMBSTONE, px=int(self.invalidation_ttl * 1000))
+            await pipeline.execute()
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+def create_cache(config: CacheConfig) -> Optional[CacheBackend]:
+    """ Create cache backend set by config or return None, if caching is disabled. """
+    if config.backend == 'memory':
+        return MemoryCache(ttl=config.ttl, invalidation_ttl=config.invalidation_ttl, max_size=config.max_size)
+    if config.backend == 'redis':
+        return RedisCache(ttl=config.ttl, invalidation_ttl=config.invalidation_ttl, url=config.url)
+    return None
+
+
+@lru_cache
+def get_cache() -> Optional[CacheBackend]:
+    """ Return cache backend of this worker. """
+    return create_cache(get_config().cache)
@@ -0,0 +1,255 @@
+"""
+Charts of user's activities computed from a flat array of hourly activities by NumPy. The arrays are cached
+by user's data version, so they are read once per change of user's data.
+
+PNG charts are drawn into a buffer of palette indexes and encoded by `encode_png` in a pool of processes,
+rendered images are cached on local disk.
+"""
+import asyncio
+import base64
+import multiprocessing
+import os
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from pathlib import Path
+from typing import Tuple, Optional
+
+import numpy as np
+
+import schemas
+from cache import MISSING
+from config import get_config
+from database.models import ActivityTypes
+from database.repositories import DatabaseRepo
+
+# Amount of `ActivityTypes` values including 0, which stands for an hour without activity
+TYPES_AMOUNT: int = len(ActivityTypes) + 1
+
+# RGB colors of palette indexes of PNG charts: 0 - an hour without activity, then `ActivityTypes` values
+ACTIVITY_COLORS = {
+    ActivityTypes.SLEEP: (63, 81, 181),
+    ActivityTypes.WORK: (229, 57, 53),
+    ActivityTypes.STUDYING: (251, 140, 0),
+    ActivityTypes.FAMILY: (67, 160, 71),
+    ActivityTypes.FRIENDS: (0, 172, 193),
+    ActivityTypes.PASSIVE: (142, 36, 170),
+    ActivityTypes.EXERCISE: (253, 216, 53),
+    ActivityTypes.READING: (109, 76, 65),
+}
+BACKGROUND: int = TYPES_AMOUNT
+PALETTE: np.ndarray = np.array(
+    [(224, 224, 224)] + [ACTIVITY_COLORS[activity_type] for activity_type in ActivityTypes] + [(255, 255, 255)],
+    dtype=np.uint8,
+)
+
+MARGIN: int = 8
+# Size of an hour in pixels on year in pixels chart, where days are columns and hours are rows
+HOUR_WIDTH: int = 2
+HOUR_HEIGHT: int = 8
+# Size of a month bar in pixels on stacked bars chart, the height stands for all hours of the month
+BAR_WIDTH: int = 32
+BAR_GAP: int = 8
+BAR_HEIGHT: int = 240
+
+PNG_SIGNATURE: bytes = b'\x89PNG\r\n\x1a\n'
+
+
+def get_year_range(year: int, tz_delta: int) -> Tuple[datetime, datetime]:
+    """ Return [start, end) of the year in user's local time as UTC times. """
+    tz_shift = timedelta(hours=tz_delta)
+    return datetime(year, 1, 1) - tz_shift, datetime(year + 1, 1, 1) - tz_shift
+
+
+async def get_year_slots(db: DatabaseRepo, user_id: int, tz_delta: int, year: int) -> np.ndarray:
+    """
+    Get `ActivityTypes` values of every hour of the year in user's local time, 0 for empty hours. They are
+    read from the cache by user's data version, if the repository has a cache.
+    :param db: Repository of the request.
+    :param user_id: The user's telegram ID.
+    :param tz_delta: User's time zone delta.
+    :param year: The year.
+    :return: Array of int8 values.
+    """
+    key = data_version = None
+    if db.cache is not None:
+        key = f'user:{user_id}:slots_{year}'
+        data_version = await db.users.get_data_version(user_id)
+        cached = await db.cache.get(key)
+        # Slots are cached with their data version under one key, so slots of previous versions don't pile up
+        if cached is not MISSING and cached[0] == data_version:
+            return np.frombuffer(base64.b64decode(cached[1]), dtype=np.int8)
+
+    from_time, to_time = get_year_range(year, tz_delta)
+    slots = np.array(await db.users.get_activity_slots(user_id, from_time, to_time), dtype=np.int8)
+    if key is not None:
+        # Bytes of the array are about 9 KB, nested lists of the heatmap would take hundreds of KB per value
+        await db.cache.set(key, [data_version, base64.b64encode(slots.tobytes()).decode()])
+    return slots
+
+
+def build_heatmap(slots: np.ndarray, year: int) -> dict:
+    """
+    Build heatmap matrices of a year.
+    :param slots: `ActivityTypes` values of every hour of the year in user's local time, 0 for empty hours.
+    :param year: The year.
+    :return: Activity types of every day by hour and amounts of hours of every type by weekday and hour.
+    """
+    day_hour = slots.reshape(-1, 24)
+    weekdays = (np.arange(len(day_hour)) + datetime(year, 1, 1).weekday()) % 7
+    # Index of every hour in a [type, weekday, hour] matrix, so the matrix is counted by one bincount
+    indexes = (day_hour.astype(np.intp) * 7 + weekdays[:, None]) * 24 + np.arange(24)
+    hour_weekday = np.bincount(indexes.ravel(), minlength=TYPES_AMOUNT * 7 * 24).reshape(TYPES_AMOUNT, 7, 24)
+    return {
+        'year': year,
+        'types': [activity_type.name for activity_type in ActivityTypes],
+        'totals': hour_weekday[1:].sum(axis=(1, 2)).tolist(),
+        'hour_weekday': hour_weekday[1:].tolist(),
+        'day_hour': day_hour.tolist(),
+    }
+
+
+async def get_heatmap(db: DatabaseRepo, user_id: int, tz_delta: int, year: int) -> dict:
+    """
+    Get heatmap of user's year in user's local time, see `build_heatmap`.
+    :param db: Repository of the request.
+    :param user_id: The user's telegram ID.
+    :param tz_delta: User's time zone delta.
+    :param year: The year.
+    :return: Heatmap like `schemas.HeatmapOut`.
+    """
+    return build_heatmap(await get_year_slots(db, user_id, tz_delta, year), year)
+
+
+def encode_png(pixels: np.ndarray) -> bytes:
+    """
+    Encode an image as PNG with `PALETTE` colors.
+    :param pixels: Palette indexes of pixels, [row][column] array of uint8.
+    :return: PNG file bytes.
+    """
+    height, width = pixels.shape
+    # Every row starts with the byte of filter type, 0 - no filter
+    rows = np.zeros((height, width + 1), dtype=np.uint8)
+    rows[:, 1:] = pixels
+
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+    # 8 bits per pixel, color type 3 - palette indexes
+    header = struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)
+    return (
+        PNG_SIGNATURE
+        + chunk(b'IHDR', header)
+        + chunk(b'PLTE', PALETTE.tobytes())
+        + chunk(b'IDAT', zlib.compress(rows.tobytes(), 9))
+        + chunk(b'IEND', b'')
+    )
+
+
+def draw_year_pixels(slots: np.ndarray, year: int) -> np.ndarray:
+    """ Draw activity of every hour of the year, days are columns from left to right and hours are rows. """
+    hour_day = slots.reshape(-1, 24).T.astype(np.uint8)
+    grid = np.repeat(np.repeat(hour_day, HOUR_HEIGHT, axis=0), HOUR_WIDTH, axis=1)
+    return np.pad(grid, MARGIN, constant_values=BACKGROUND)
+
+
+def draw_stacked_bars(slots: np.ndarray, year: int) -> np.ndarray:
+    """
+    Draw a bar of every month stacked from hours of every activity type from the bottom in order of
+    `ActivityTypes`, hours without activity are on the top.
+    """
+    days = np.arange(f'{year}-01-01', f'{year + 1}-01-01', dtype='datetime64[D]')
+    months = days.astype('datetime64[M]').astype(np.intp) % 12
+    indexes = months[:, None] * TYPES_AMOUNT + slots.reshape(-1, 24)
+    counts = np.bincount(indexes.ravel(), minlength=12 * TYPES_AMOUNT).reshape(12, TYPES_AMOUNT)
+    # Hours without activity go last, so they are on the top of bars
+    order = np.roll(np.arange(TYPES_AMOUNT, dtype=np.uint8), -1)
+    counts = counts[:, order]
+    # Heights are rounded by cumulative sums, so every bar is exactly `BAR_HEIGHT` pixels
+    edges = np.rint(np.cumsum(counts, axis=1) * BAR_HEIGHT / counts.sum(axis=1, keepdims=True)).astype(np.intp)
+    heights = np.diff(edges, axis=1, prepend=0)
+
+    pixels = np.full((BAR_HEIGHT + 2 * MARGIN, 12 * (BAR_WIDTH + BAR_GAP) - BAR_GAP + 2 * MARGIN), BACKGROUND,
+                     dtype=np.uint8)
+    for month in range(12):
+        bar = np.repeat(order, heights[month])[::-1]
+        left = MARGIN + month * (BAR_WIDTH + BAR_GAP)
+        pixels[MARGIN:MARGIN + BAR_HEIGHT, left:left + BAR_WIDTH] = bar[:, None]
+    return pixels
+
+
+CHART_DRAWERS = {
+    schemas.ChartType.YEAR_PIXELS: draw_year_pixels,
+    schemas.ChartType.STACKED_BARS: draw_stacked_bars,
+}
+
+
+def render_chart(chart: schemas.ChartType, slots: np.ndarray, year: int) -> bytes:
+    """ Draw the chart of a year by `ActivityTypes` values of its hours and encode it as PNG. """
+    return encode_png(CHART_DRAWERS[chart](slots, year))
+
+
+@lru_cache
+def get_render_pool() -> ProcessPoolExecutor:
+    """ Return pool of processes which render charts of this worker. """
+    # Processes are spawned, because forking a running event loop with open connections isn't safe
+    return ProcessPoolExecutor(get_config().charts.render_workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def close_render_pool() -> None:
+    """ Shut down the pool of processes which render charts, if it was started. """
+    if get_render_pool.cache_info().currsize:
+        get_render_pool().shutdown(cancel_futures=True)
+        get_render_pool.cache_clear()
+
+
+def get_chart_path(user_id: int, chart: schemas.ChartType, year: int, data_version: Optional[int]) -> Path:
+    """ Return path of the rendered chart in the disk cache. """
+    return Path(get_config().charts.cache_dir) / str(user_id) / f'{chart.value}-{year}-{data_version}.png'
+
+
+def read_chart(path: Path) -> Optional[bytes]:
+    """ Read the rendered chart from the disk cache, None if it isn't rendered yet. """
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def write_chart(path: Path, png: bytes) -> None:
+    """ Write the rendered chart to the disk cache and remove its renders of previous data versions. """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # The file is replaced atomically, so other workers never read a partly written file
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    temp_path.write_bytes(png)
+    os.replace(temp_path, path)
+
+    chart_prefix = path.name.rsplit('-', 1)[0]
+    for outdated_path in path.parent.glob(f'{chart_prefix}-*.png'):
+        if outdated_path != path:
+            outdated_path.unlink(missing_ok=True)
+
+
+async def get_chart_png(db: DatabaseRepo, user_id: int, tz_delta: int, chart: schemas.ChartType, year: int) -> bytes:
+    """
+    Get PNG of user's chart of a year in user's local time. It is read from the disk cache by user's data
+    version, so a repeated request reads only the version, which is cached too. Otherwise, the chart is
+    rendered in the pool of processes.
+    :param db: Repository of the request.
+    :param user_id: The user's telegram ID.
+    :param tz_delta: User's time zone delta.
+    :param chart: Type of the chart.
+    :param year: The year.
+    :return: PNG file bytes.
+    """
+    path = get_chart_path(user_id, chart, year, await db.users.get_data_version(user_id))
+    png = await asyncio.to_thread(read_chart, path)
+    if png is not None:
+        return png
+
+    slots = await get_year_slots(db, user_id, tz_delta, year)
+    png = await asyncio.get_running_loop().run_in_executor(get_render_pool(), render_chart, chart, slots, year)
+    await asyncio.to_thread(write_chart, path, png)
+    return png
@@ -0,0 +1,86 @@
+"""
+Command to move existing activities from `actions` rows into `activity_days` grid.
+
+Switch `POSTGRES_ACTIVITY_STORAGE` to "dual", so new activities are written to both storages, then move existing
+data in chunks of users (run from the `api_service` directory):
+    python -m database.grid --chunk-size 100
+After that `POSTGRES_ACTIVITY_STORAGE` can be switched to "grid". Moving is idempotent and can be rerun.
+"""
+import argparse
+import asyncio
+from collections import defaultdict
+from datetime import date
+from typing import Dict, Tuple, List
+
+from loguru import logger
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Activity, ActivityDay, User
+from .repositories import ActivityGridRepo
+
+
+async def move_activities(session: AsyncSession, from_user_id: int, to_user_id: int) -> int:
+    """
+    Copy activities of users with IDs in range [from_user_id, to_user_id] into days grid and commit them.
+
+    :param session: Session to the database.
+    :param from_user_id: The first user's telegram ID of the range.
+    :param to_user_id: The last user's telegram ID of the range.
+    :return: Amount of copied activities.
+    """
+    select_stmt = (
+        select(Activity.user_id, Activity.time, Activity.type)
+        .where(Activity.user_id.between(from_user_id, to_user_id))
+    )
+    slots_by_day: Dict[Tuple[int, date], List[int]] = defaultdict(lambda: [ActivityGridRepo.EMPTY_SLOT] * 24)
+    activities_amount = 0
+    for user_id, time, activity_type in (await session.execute(select_stmt)).tuples():
+        slots_by_day[(user_id, time.date())][time.hour] = activity_type.value
+        activities_amount += 1
+
+    values = [dict(user_id=user_id, day=day, slots=slots) for (user_id, day), slots in slots_by_day.items()]
+    for chunk_start in range(0, len(values), ActivityGridRepo.INSERT_CHUNK_SIZE):
+        insert_stmt = insert(ActivityDay).values(values[chunk_start:chunk_start + ActivityGridRepo.INSERT_CHUNK_SIZE])
+        insert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=[ActivityDay.user_id, ActivityDay.day],
+            set_=dict(slots=func.merge_activity_slots(ActivityDay.slots, insert_stmt.excluded.slots)),
+        )
+        await session.execute(insert_stmt)
+    await session.commit()
+
+    return activities_amount
+
+
+async def backfill(chunk_size: int) -> None:
+    """ Move activities of every user, taking `chunk_size` users per transaction. """
+    from .session_manager import session_manager
+
+    session_manager.init()
+    last_user_id, users_done, activities_done = 0, 0, 0
+    async with session_manager.create_session() as session:
+        while True:
+            select_stmt = (
+                select(User.id)
+                .where(User.id > last_user_id)
+                .order_by(User.id)
+                .limit(chunk_size)
+            )
+            user_ids = (await session.scalars(select_stmt)).all()
+            if not user_ids:
+                break
+
+            activities_done += await move_activities(session, user_ids[0], user_ids[-1])
+            last_user_id = user_ids[-1]
+            users_done += len(user_ids)
+            logger.info(f'{activities_done} activities of {users_done} users have been moved (last ID: {last_user_id})')
+    await session_manager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunk-size', type=int, default=100, help='Amount of users moved in one transaction.')
+    args = parser.parse_args()
+
+    asyncio.run(backfill(args.chunk_size))
@@ -1,8 +1,8 @@
 import enum
-from datetime import datetime
-from typing import List
+from datetime import datetime, date
+from typing import List, Optional
 
-from sqlalchemy import ForeignKey, String, TIMESTAMP, BIGINT, SMALLINT
+from sqlalchemy import ForeignKey, String, TIMESTAMP, BIGINT, SMALLINT, Date, UniqueConstraint
 from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import DeclarativeBase, relationship
 from sqlalchemy.orm import Mapped
@@ -25,6 +25,10 @@ class User(Base):
     last_activity: Mapped[datetime] = mapped_column(TIMESTAMP, server_default=utcnow())
     notify_hours: Mapped[List[int]] = mapped_column(ARRAY(SMALLINT), nullable=True)
     time_zone_delta: Mapped[int] = mapped_column(SMALLINT, default=0)  # In hours. UTC+3 = 3. UTC-2 = -2
+    # Denormalized time of the latest user's activity, kept current by `UserRepo.add_activities`
+    last_activity_time: Mapped[Optional[datetime]] = mapped_column(TIMESTAMP, nullable=True)
+    # Incremented by every `UserRepo` write of data which read endpoints return, it is their ETag
+    data_version: Mapped[int] = mapped_column(BIGINT, server_default='0')
 
     activities: Mapped[List["Activity"]] = relationship(back_populates="user", cascade="all")
 
@@ -32,6 +36,17 @@ class User(Base):
         return f"<User: {self.id}>"
 
 
+class NotifySchedule(Base):
+    """ Class which represents an hour when user should be notified. Mirrors `User.notify_hours` for fast lookups """
+    __tablename__ = "user_notify_schedule"
+
+    hour: Mapped[int] = mapped_column(SMALLINT, primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+
+    def __repr__(self) -> str:
+        return f"<NotifySchedule: {self.user_id} at {self.hour} hour>"
+
+
 class ActivityTypes(enum.Enum):
     SLEEP = 1
     WORK = 2
@@ -46,13 +61,58 @@ class ActivityTypes(enum.Enum):
 class Activity(Base):
     """ Class which represents user's activities at a certain time """
     __tablename__ = "actions"
-
-    id: Mapped[int] = mapped_column(primary_key=True)
+    __table_args__ = (
+        # User can't have two activities at the same hour. Also lets "last activity" lookups and per-user
+        # time range scans seek the index instead of sorting user's history
+        UniqueConstraint('user_id', 'time', name='uq_actions_user_id_time'),
+        # Monthly partitions are created ahead of time by `database.partitions`
+        {'postgresql_partition_by': 'RANGE (time)'},
+    )
+
+    # Primary key of a partitioned table has to include the partition key
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
     type: Mapped[ActivityTypes]
-    time: Mapped[datetime] = mapped_column(TIMESTAMP, default=utcnow())
+    time: Mapped[datetime] = mapped_column(TIMESTAMP, primary_key=True, default=utcnow())
 
     user: Mapped["User"] = relationship(back_populates="activities")
 
     def __repr__(self) -> str:
         return f'<Activity at {self.time.strftime("%d/%m/%Y at %H hours")} type: {self.type}>'
+
+
+class ActivityDay(Base):
+    """
+    Class which represents user's activities of a whole day (in UTC) as 24 hourly slots.
+    Every slot holds `ActivityTypes` value of the hour or 0 if the hour isn't set yet.
+    It is the compact alternative to `Activity` rows, see `DBConfig.activity_storage`.
+    """
+    __tablename__ = "activity_days"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    slots: Mapped[List[int]] = mapped_column(ARRAY(SMALLINT, dimensions=1))
+
+    def __repr__(self) -> str:
+        return f'<ActivityDay {self.day} of user {self.user_id}>'
+
+
+class RollupPeriods(enum.Enum):
+    DAY = 'day'
+    WEEK = 'week'  # Weeks start on Monday, as in Postgres `date_trunc`
+    MONTH = 'month'
+
+
+class ActivityRollup(Base):
+    """ Class which represents amount of user's activity hours of a certain type during a period (in UTC) """
+    __tablename__ = "user_activity_rollups"
+
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), primary_key=True)
+    period: Mapped[RollupPeriods] = mapped_column(primary_key=True)
+    period_start: Mapped[date] = mapped_column(Date, primary_key=True)
+    type: Mapped[ActivityTypes] = mapped_column(primary_key=True)
+    amount: Mapped[int]
+
+    def __repr__(self) -> str:
+        return f'<ActivityRollup {self.period.value} from {self.period_start} type: {self.type} amount: {self.amount}>'
+
@@ -0,0 +1,179 @@
+import functools
+import inspect
+import time
+from contextvars import ContextVar
+from typing import Optional, Any, List, Callable
+
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, Connection, ExecutionContext
+
+import metrics
+from config import get_config
+
+# Label of statements which aren't executed by a repository method (migrations, maintenance and so on)
+OUTSIDE_REPOSITORIES: str = 'other'
+
+# Name like "UserRepo.get_last_activity" of the innermost repository method which is running. SQLAlchemy runs
+# statements of the async engine in a greenlet which shares the context of the awaiting coroutine
+repository_method: ContextVar[str] = ContextVar('repository_method', default=OUTSIDE_REPOSITORIES)
+
+
+def track_repository_method(name: str, method: Callable) -> Callable:
+    """
+    Wrap a coroutine or async generator method, so `repository_method` is set to `name` while it runs.
+    Steps of an async generator are wrapped one by one, so the caller's statements between them aren't counted
+    as statements of the generator.
+    """
+    if inspect.isasyncgenfunction(method):
+        @functools.wraps(method)
+        async def async_generator_wrapper(*args, **kwargs):
+            generator = method(*args, **kwargs)
+            try:
+                while True:
+                    token = repository_method.set(name)
+                    try:
+                        item = await generator.__anext__()
+                    except StopAsyncIteration:
+                        return
+                    finally:
+                        repository_method.reset(token)
+                    yield item
+            finally:
+                await generator.aclose()
+
+        return async_generator_wrapper
+
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        token = repository_method.set(name)
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            repository_method.reset(token)
+
+    return wrapper
+
+
+def track_repository_methods(cls: type) -> None:
+    """ Wrap async methods defined by the repository class by `track_repository_method`. """
+    for name, method in list(vars(cls).items()):
+        if inspect.iscoroutinefunction(method) or inspect.isasyncgenfunction(method):
+            setattr(cls, name, track_repository_method(f'{cls.__name__}.{name}', method))
+
+
+def get_parameters_shape(parameters: Any, executemany: bool = False) -> str:
+    """
+    Describe parameters of statement by their types and lengths without values, like "(int, datetime, list[24])".
+    :param parameters: Parameters of statement in DBAPI format.
+    :param executemany: Whether `parameters` is a list of parameters sets.
+    :return: Shape of parameters.
+    """
+    if executemany:
+        return f'{len(parameters)} x {get_parameters_shape(parameters[0])}' if parameters else '[]'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{name}: {get_parameters_shape(value)}' for name, value in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        if isinstance(parameters, list) or len(parameters) > 100:
+            return f'{type(parameters).__name__}[{len(parameters)}]'
+        return '(' + ', '.join(get_parameters_shape(value) for value in parameters) + ')'
+    return type(parameters).__name__
+
+
+class SlowQueryLog:
+    """
+    Log of statements which take longer than `threshold` seconds: their SQL, shape of parameters, duration and
+    the repository method which executed them. If `explain` is set, plans of slow SELECT statements are captured
+    by `EXPLAIN (ANALYZE, BUFFERS)`, which runs the statement once more in a savepoint of its transaction.
+    """
+    # Multi-row inserts have very long SQL, only its beginning is logged
+    MAX_STATEMENT_LENGTH: int = 2000
+
+    def __init__(self, threshold: float, path: str, explain: bool = False):
+        self.threshold = threshold
+        self.explain = explain
+        self.logger = logger.bind(slow_query=True)
+        logger.add(
+            path,
+            rotation='10 MB',
+            retention=1,
+            filter=lambda record: record['extra'].get('slow_query', False),
+        )
+
+    def get_plan(self, conn: Connection, statement: str, parameters: Any) -> List[str]:
+        """ Run the statement by `EXPLAIN (ANALYZE, BUFFERS)` without events and return the plan lines. """
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute('SAVEPOINT slow_query_explain')
+            try:
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {statement}', parameters)
+                return [line for line, in cursor.fetchall()]
+            finally:
+                cursor.execute('ROLLBACK TO SAVEPOINT slow_query_explain')
+        finally:
+            cursor.close()
+
+    def record(
+            self,
+            conn: Connection,
+            statement: str,
+            parameters: Any,
+            context: Optional[ExecutionContext],
+            executemany: bool,
+            duration: float,
+            method: str,
+    ) -> None:
+        if duration < self.threshold:
+            return
+
+        sql = statement if len(statement) <= self.MAX_STATEMENT_LENGTH else (
+            f'{statement[:self.MAX_STATEMENT_LENGTH]}... ({len(statement)} characters)'
+        )
+        message = (
+            f'Slow query: {duration:.3f}s in {method}\n'
+            f'{sql}\n'
+            f'Parameters: {get_parameters_shape(parameters, executemany)}'
+        )
+
+        is_streamed = context is not None and context.execution_options.get('stream_results', False)
+        if self.explain and not executemany and not is_streamed and statement.lstrip().upper().startswith('SELECT'):
+            try:
+                message += '\n' + '\n'.join(self.get_plan(conn, statement, parameters))
+            except Exception as e:
+                message += f'\nUnable to explain the statement: {e!r}'
+        self.logger.warning(message)
+
+
+slow_query_log: Optional[SlowQueryLog] = None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    # The start time lives on the execution context, so it's dropped with it when the statement fails
+    context.query_start_time = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    duration = time.perf_counter() - context.query_start_time
+    method = repository_method.get()
+    metrics.DB_STATEMENT_DURATION.labels(method=method).observe(duration)
+    if slow_query_log is not None:
+        slow_query_log.record(conn, statement, parameters, context, executemany, duration, method)
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Record durations of statements executed by `engine` in metrics and log slow statements, if it is enabled
+    by `DBConfig.slow_query_threshold`.
+    """
+    global slow_query_log
+
+    config = get_config()
+    if config.db.slow_query_threshold > 0 and slow_query_log is None:
+        slow_query_log = SlowQueryLog(
+            threshold=config.db.slow_query_threshold,
+            path=config.db.slow_query_log,
+            explain=bool(config.debug) and config.db.slow_query_explain,
+        )
+
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
@@ -0,0 +1,140 @@
+"""
+Maintenance of monthly range partitions of the `actions` table.
+
+API service creates partitions ahead of time on startup and then once a day. It also can be done manually
+(run from the `api_service` directory):
+    python -m database.partitions --months-ahead 3
+"""
+import argparse
+import asyncio
+from datetime import date, datetime
+from typing import List, Optional
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# Any constant key of the advisory lock, so workers don't create the same partitions concurrently
+PARTITIONS_LOCK_KEY: int = 7_105_202_401
+# Partition of activities which have no monthly partition, like ones posted late for a month before the first one
+DEFAULT_PARTITION: str = 'actions_default'
+
+
+def add_months(month_start: date, months: int) -> date:
+    """ Return the first day of the month which is `months` months after `month_start`. """
+    month_index = month_start.year * 12 + month_start.month - 1 + months
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def get_partition_name(month_start: date) -> str:
+    """ Return the name of the `actions` partition for the month starting at `month_start`. """
+    return f"actions_y{month_start.year}m{month_start.month:02d}"
+
+
+async def create_month_partition(connection: AsyncConnection, month_start: date, has_default: bool) -> None:
+    """
+    Create the partition of `actions` for the month starting at `month_start`. Doesn't commit.
+
+    :param connection: Connection to the database.
+    :param month_start: The first day of the month.
+    :param has_default: Whether `actions` has the default partition, which may hold activities of the month.
+    """
+    partition_name, month_end = get_partition_name(month_start), add_months(month_start, 1)
+    if has_default:
+        # Activities are kept aside while the partition is created and then inserted back into `actions`,
+        # which routes them to the new partition
+        await connection.execute(text(
+            f"CREATE TEMPORARY TABLE moved_actions AS "
+            f"WITH moved AS ("
+            f"DELETE FROM {DEFAULT_PARTITION} "
+            f"WHERE time >= '{month_start.isoformat()}' AND time < '{month_end.isoformat()}' RETURNING *"
+            f") SELECT * FROM moved"
+        ))
+
+    await connection.execute(text(
+        f"CREATE TABLE {partition_name} PARTITION OF actions "
+        f"FOR VALUES FROM ('{month_start.isoformat()}') TO ('{month_end.isoformat()}')"
+    ))
+
+    if has_default:
+        result = await connection.execute(text("INSERT INTO actions SELECT * FROM moved_actions"))
+        await connection.execute(text("DROP TABLE moved_actions"))
+        if result.rowcount:
+            logger.info(f"Moved {result.rowcount} activities from {DEFAULT_PARTITION} to {partition_name}")
+
+
+async def create_actions_partitions(
+        connection: AsyncConnection, months_ahead: int, from_date: Optional[date] = None
+) -> List[str]:
+    """
+    Create missing monthly partitions of `actions` from the month of `from_date` up to `months_ahead` months
+    after the current one. Activities of a new month which are in the default partition are moved to the new
+    partition, otherwise Postgres can't create it. Doesn't commit.
+
+    :param connection: Connection to the database.
+    :param months_ahead: Amount of future months which should already have partitions.
+    :param from_date: Date from which partitions are created. Current UTC date by default.
+    :return: Names of created partitions.
+    """
+    await connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITIONS_LOCK_KEY})
+    result = await connection.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class AS parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class AS child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = 'actions'"
+    ))
+    existing_partitions = set(result.scalars().all())
+
+    current_month = (from_date or datetime.utcnow().date()).replace(day=1)
+    last_month = add_months(datetime.utcnow().date().replace(day=1), months_ahead)
+    created_partitions = []
+    while current_month <= last_month:
+        partition_name = get_partition_name(current_month)
+        if partition_name not in existing_partitions:
+            await create_month_partition(connection, current_month, DEFAULT_PARTITION in existing_partitions)
+            created_partitions.append(partition_name)
+        current_month = add_months(current_month, 1)
+
+    return created_partitions
+
+
+async def run_partitions_maintenance(months_ahead: int, interval: float = 24 * 60 * 60) -> None:
+    """
+    Create future partitions every `interval` seconds, forever. Started as a background task of API service.
+
+    :param months_ahead: Amount of future months which should already have partitions.
+    :param interval: Seconds between two checks.
+    """
+    from .session_manager import session_manager
+
+    while True:
+        try:
+            async with session_manager.create_connect() as connection:
+                created_partitions = await create_actions_partitions(connection, months_ahead)
+            if created_partitions:
+                logger.info(f"Created partitions of actions: {', '.join(created_partitions)}")
+        except Exception:
+            logger.exception("Unable to create partitions of actions")
+        await asyncio.sleep(interval)
+
+
+async def main(months_ahead: int, from_date: Optional[date]) -> None:
+    from .session_manager import session_manager
+
+    session_manager.init()
+    async with session_manager.create_connect() as connection:
+        created_partitions = await create_actions_partitions(connection, months_ahead, from_date)
+    await session_manager.close()
+    logger.info(f"Created partitions of actions: {', '.join(created_partitions) or 'nothing'}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--months-ahead', type=int, default=3, help='Amount of future months to create.')
+    parser.add_argument(
+        '--from-date', type=date.fromisoformat, default=None,
+        help='Create partitions starting from the month of this date (YYYY-MM-DD), e.g. before loading history.',
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(args.months_ahead, args.from_date))
@@ -1,16 +1,33 @@
-from typing import Optional, List, Sequence, Dict, Tuple
+from collections import defaultdict
+from datetime import datetime, date, timezone, timedelta
+from typing import Optional, List, Sequence, Dict, Tuple, AsyncIterator, Union
 
-from sqlalchemy import update, select, func, Row
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy import update, select, func, Row, delete, Date, TIMESTAMP, SMALLINT, Interval, Select, Subquery
+from sqlalchemy import true, literal, cast, type_coerce, lambda_stmt, ColumnElement, ScalarSelect, case, Integer
+from sqlalchemy.dialects.postgresql import insert, ARRAY, aggregate_order_by
 from sqlalchemy.ext.asyncio import AsyncSession
 
 import schemas
+from cache import CacheBackend, MISSING
+from config import get_config
 from .func import utcnow
-from .models import User, Activity, Base, ActivityTypes
+from .monitoring import track_repository_methods
+from .models import User, Activity, Base, ActivityTypes, ActivityRollup, RollupPeriods, NotifySchedule, ActivityDay
+from .rollups import get_rollup_increments
+from .touches import UserTouchBuffer
 
 
 class BaseRepo:
     """ A class representing a base repository for handling database operations. """
+    # Rows per multi-row INSERT. Keeps statements under the Postgres limit of 32767 bind parameters
+    INSERT_CHUNK_SIZE: int = 10000
+    # Rows per multi-row INSERT of rollups, which have 5 bind parameters per row
+    ROLLUP_CHUNK_SIZE: int = 6000
+
+    def __init_subclass__(cls, **kwargs):
+        """ Wrap async methods of repositories, so statements are labeled by the method which executes them. """
+        super().__init_subclass__(**kwargs)
+        track_repository_methods(cls)
 
     def __init__(self, session: AsyncSession):
         self.session = session
@@ -24,7 +41,157 @@ class BaseRepo:
         await self.session.commit()
 
 
+track_repository_methods(BaseRepo)
+
+
+class ActivityGridRepo(BaseRepo):
+    """ Repository for user's activities stored as days with 24 hourly slots (see `ActivityDay`). """
+    EMPTY_SLOT: int = 0
+
+    @staticmethod
+    def get_activity_id(time: datetime) -> int:
+        """ Days have no IDs of activities, so an activity is identified by its hour since Unix epoch. """
+        return int(time.replace(tzinfo=timezone.utc).timestamp()) // 3600
+
+    async def add_activities(
+            self, user_id: int, activities_by_time: Dict[datetime, ActivityTypes]
+    ) -> List[Tuple[ActivityTypes, datetime]]:
+        """
+        Set empty hourly slots of user's days. Slots which are already set are skipped.
+        Doesn't commit, so it runs in the transaction of activities inserting.
+        :param user_id: The user's telegram ID in the database.
+        :param activities_by_time: New activities types by their time in UTC.
+        :return: Pairs of activity type and activity time of activities which were set.
+        """
+        hours_by_day: Dict[date, Dict[int, ActivityTypes]] = defaultdict(dict)
+        for time, activity_type in activities_by_time.items():
+            hours_by_day[time.date()][time.hour] = activity_type
+
+        # Rows of new days can't be locked before they exist, so requests of the same user are serialized by
+        # an advisory lock. Otherwise, concurrent requests would count the same empty slots as set by both
+        lock_key = func.hashtextextended(ActivityDay.__tablename__, user_id)
+        await self.session.execute(select(func.pg_advisory_xact_lock(lock_key)))
+        select_stmt = (
+            select(ActivityDay.day, ActivityDay.slots)
+            .where(ActivityDay.user_id == user_id, ActivityDay.day.in_(list(hours_by_day)))
+            .with_for_update()
+        )
+        existing_slots: Dict[date, List[int]] = dict((await self.session.execute(select_stmt)).tuples().all())
+
+        inserted: List[Tuple[ActivityTypes, datetime]] = []
+        values = []
+        for day, hours in hours_by_day.items():
+            slots = list(existing_slots.get(day) or [self.EMPTY_SLOT] * 24)
+            for hour, activity_type in hours.items():
+                if slots[hour] == self.EMPTY_SLOT:
+                    slots[hour] = activity_type.value
+                    inserted.append((activity_type, datetime(day.year, day.month, day.day, hour)))
+            values.append(dict(user_id=user_id, day=day, slots=slots))
+
+        for chunk_start in range(0, len(values), self.INSERT_CHUNK_SIZE):
+            insert_stmt = insert(ActivityDay).values(values[chunk_start:chunk_start + self.INSERT_CHUNK_SIZE])
+            insert_stmt = insert_stmt.on_conflict_do_update(
+                index_elements=[ActivityDay.user_id, ActivityDay.day],
+                # Days may be created by `python -m database.grid` meanwhile, so slots are merged instead of replaced
+                set_=dict(slots=func.merge_activity_slots(ActivityDay.slots, insert_stmt.excluded.slots)),
+            )
+            await self.session.execute(insert_stmt)
+
+        return inserted
+
+    async def get_last_activity(self, user_id: int) -> Optional[Activity]:
+        """
+        Get last created activity by user with `user_id` from the day of `User.last_activity_time`.
+        :param user_id: The user's telegram ID in the database.
+        :return: Last created user's activity. It isn't bound to the session.
+        """
+        select_stmt = (
+            select(User.last_activity_time, ActivityDay.slots)
+            .join(
+                ActivityDay,
+                (ActivityDay.user_id == User.id) & (ActivityDay.day == User.last_activity_time.cast(Date)),
+            )
+            .where(User.id == user_id)
+        )
+        row = (await self.session.execute(select_stmt)).first()
+        if row is None:
+            return None
+
+        time, slots = row
+        return Activity(
+            id=self.get_activity_id(time),
+            user_id=user_id,
+            type=ActivityTypes(slots[time.hour]),
+            time=time,
+        )
+
+    @classmethod
+    def select_days_hours(cls, *where: ColumnElement[bool]) -> Subquery:
+        """
+        Build a subquery of activities unpacked from days matched by `where` into rows like `actions` has.
+        :param where: Conditions of `ActivityDay` rows.
+        :return: Subquery of columns `user_id`, `time` and `type`.
+        """
+        activity_type = Activity.type.type
+        slot = func.unnest(ActivityDay.slots).table_valued('type_id', with_ordinality='hour').render_derived()
+        return (
+            select(
+                ActivityDay.user_id,
+                (ActivityDay.day.cast(TIMESTAMP) + (slot.c.hour - 1) * literal(timedelta(hours=1), Interval))
+                .label('time'),
+                # Slots hold values of `ActivityTypes`, which are positions of the enum labels
+                type_coerce(
+                    func.enum_range(cast(None, activity_type), type_=ARRAY(activity_type))[slot.c.type_id],
+                    activity_type,
+                ).label('type'),
+            )
+            .select_from(ActivityDay)
+            .join(slot, true())
+            .where(*where, slot.c.type_id != cls.EMPTY_SLOT)
+            .subquery()
+        )
+
+    @classmethod
+    def select_users_activity_hours(cls, from_user_id: int, to_user_id: int) -> Select:
+        """
+        Build a select of all activities of users with IDs in range [from_user_id, to_user_id].
+        :param from_user_id: The first user's telegram ID of the range.
+        :param to_user_id: The last user's telegram ID of the range.
+        :return: Select of columns `user_id`, `time` and `type`.
+        """
+        days_hours = cls.select_days_hours(ActivityDay.user_id.between(from_user_id, to_user_id))
+        return select(days_hours.c.user_id, days_hours.c.time, days_hours.c.type)
+
+    def select_activity_hours(self, user_id: int, from_time: datetime, to_time: datetime) -> Select:
+        """
+        Build a select of user's activities in [from_time, to_time) unpacked from days into rows like `actions` has.
+        :param user_id: The user's telegram ID in the database.
+        :param from_time: Start of the time range in UTC.
+        :param to_time: End of the time range in UTC, exclusive.
+        :return: Select of columns `time` and `type`.
+        """
+        days_hours = self.select_days_hours(
+            ActivityDay.user_id == user_id, ActivityDay.day.between(from_time.date(), to_time.date())
+        )
+        return (
+            select(days_hours.c.time, days_hours.c.type)
+            .where(days_hours.c.time >= from_time, days_hours.c.time < to_time)
+        )
+
+
 class UserRepo(BaseRepo):
+    """
+    Repository of users and their data. Statements of hot-path methods are built by `lambda_stmt`, so SQLAlchemy
+    caches them by the lambda code instead of rebuilding and looking up the whole construct on every call.
+    Their SQL is the same on every call, so asyncpg reuses the prepared statements cached per connection.
+    """
+
+    # Users per multi-row upsert, they have up to 4 bind parameters each
+    USERS_CHUNK_SIZE: int = 5000
+
+    @property
+    def grid(self) -> ActivityGridRepo:
+        return ActivityGridRepo(self.session)
 
     async def get_ids_to_notify(self, hour: int) -> Sequence[int]:
         """
@@ -33,50 +200,112 @@ class UserRepo(BaseRepo):
         :param hour: The hour when user's should be notified.
         :return: List of user_ids.
         """
-        get_stmt = (
-            select(User.id)
-            .where(User.notify_hours.contains([hour]))
-        )
+        get_stmt = lambda_stmt(lambda: (
+            select(NotifySchedule.user_id)
+            .where(NotifySchedule.hour == hour)
+        ))
         result = await self.session.execute(get_stmt)
         return result.scalars().all()
 
-    async def create_or_update(self, user_id: int, language: str, username: Optional[str] = None) -> Tuple[User, bool]:
+    async def create_or_update(self, user_id: int, language: str, username: Optional[str] = None) -> Tuple[Row, bool]:
         """
         Creates or updates a new user in the database. Return user and is_created bool.
         :param user_id: The user's telegram ID.
         :param language: The user's language.
         :param username: The user's username. It's an optional parameter.
-        :return: The User model and bool is_created, True if it is new user, otherwise False.
+        :return: The user's row and bool is_created, True if it is new user, otherwise False.
         """
-        is_created_column = (User.joined_at == User.last_activity).label("is_created")
-        insert_stmt = (
+        insert_stmt = lambda_stmt(lambda: (
             insert(User)
             .values(
                 id=user_id,
                 username=username,
                 language=language,
             )
-            .on_conflict_do_update(
-                index_elements=[User.id],
-                set_=dict(
-                    username=username,
-                    language=language,
-                    last_activity=utcnow(),
-                ),
-            )
-            .returning(
-                User,
-                is_created_column
-            )
+        ))
+        insert_stmt += lambda stmt: stmt.on_conflict_do_update(
+            index_elements=[User.id],
+            set_=dict(
+                username=stmt.excluded.username,
+                language=stmt.excluded.language,
+                last_activity=utcnow(),
+            ),
+        )
+        insert_stmt += lambda stmt: stmt.returning(
+            User.id,
+            User.username,
+            User.language,
+            User.notify_hours,
+            User.time_zone_delta,
+            (User.joined_at == User.last_activity).label("is_created"),
         )
 
         result = await self.session.execute(insert_stmt)
+        user = result.one()
         await self.session.commit()
 
-        user, is_created = result.one()
-        await self.session.refresh(user)
+        return user, user.is_created
 
-        return user, is_created
+    async def create_or_update_many(self, users: List[schemas.UserBase]) -> List[Row]:
+        """
+        Creates or updates users by one multi-row upsert per chunk, in one transaction. If a user is given several
+        times, the last one wins.
+        :param users: Users to create or update.
+        :return: Rows of users like `create_or_update` returns, with `is_created` column. Their order isn't defined.
+        """
+        values = list({
+            user.id: dict(id=user.id, username=user.username, language=user.language) for user in users
+        }.values())
+
+        rows: List[Row] = []
+        for chunk_start in range(0, len(values), self.USERS_CHUNK_SIZE):
+            insert_stmt = insert(User).values(values[chunk_start:chunk_start + self.USERS_CHUNK_SIZE])
+            insert_stmt = (
+                insert_stmt
+                .on_conflict_do_update(
+                    index_elements=[User.id],
+                    set_=dict(
+                        username=insert_stmt.excluded.username,
+                        language=insert_stmt.excluded.language,
+                        last_activity=utcnow(),
+                    ),
+                )
+                .returning(
+                    User.id,
+                    User.username,
+                    User.language,
+                    User.notify_hours,
+                    User.time_zone_delta,
+                    (User.joined_at == User.last_activity).label("is_created"),
+                )
+            )
+            rows.extend((await self.session.execute(insert_stmt)).all())
+        await self.session.commit()
+
+        return rows
+
+    async def touch_many(self, touches: Dict[int, Tuple[str, str, datetime]]) -> None:
+        """
+        Update username, language and last activity of users by one multi-row upsert per chunk.
+        Rows are locked in the order of user IDs, so concurrent flushes can't deadlock.
+        :param touches: Username, language and time of the last touch by user's telegram ID.
+        """
+        values = [
+            dict(id=user_id, username=username, language=language, last_activity=time)
+            for user_id, (username, language, time) in sorted(touches.items())
+        ]
+        for chunk_start in range(0, len(values), self.USERS_CHUNK_SIZE):
+            insert_stmt = insert(User).values(values[chunk_start:chunk_start + self.USERS_CHUNK_SIZE])
+            insert_stmt = insert_stmt.on_conflict_do_update(
+                index_elements=[User.id],
+                set_=dict(
+                    username=insert_stmt.excluded.username,
+                    language=insert_stmt.excluded.language,
+                    last_activity=func.greatest(User.last_activity, insert_stmt.excluded.last_activity),
+                ),
+            )
+            await self.session.execute(insert_stmt)
+        await self.session.commit()
 
     async def update_notify_hours(self, user_id: int, new_hours: List[int]) -> None:
         """
@@ -87,10 +316,22 @@ class UserRepo(BaseRepo):
         update_stmt = (
             update(User)
             .where(User.id == user_id)
-            .values(notify_hours=new_hours)
+            .values(notify_hours=new_hours, data_version=User.data_version + 1)
+        )
+        delete_stmt = (
+            delete(NotifySchedule)
+            .where(NotifySchedule.user_id == user_id)
         )
 
-        await self.session.execute(update_stmt)
+        result = await self.session.execute(update_stmt)
+        # There is no such user, the schedule can't reference it
+        if result.rowcount == 0:
+            return
+
+        await self.session.execute(delete_stmt)
+        if new_hours:
+            insert_stmt = insert(NotifySchedule).values([dict(hour=hour, user_id=user_id) for hour in set(new_hours)])
+            await self.session.execute(insert_stmt)
         await self.session.commit()
 
     async def get_notify_hours(self, user_id: int) -> Optional[List[int]]:
@@ -99,37 +340,200 @@ class UserRepo(BaseRepo):
         :param user_id: The user's telegram ID.
         :return: List with user notify hours or None.
         """
-        select_stmt = (
+        select_stmt = lambda_stmt(lambda: (
             select(User.notify_hours)
             .where(User.id == user_id)
-        )
+        ))
 
         result = await self.session.execute(select_stmt)
         return result.scalar_one()
 
     async def get_last_activity(self, user_id: int) -> Optional[Activity]:
         """
-        Get last created activity by user with `user_id`,
+        Get last created activity by user with `user_id`. The time predicate lets the planner prune partitions
+        of `actions`, so only one partition is scanned.
         :param user_id: The user's telegram ID in the database.
         :return: Last created user's activity.
         """
-        get_stmt = (
+        if get_config().db.activity_storage == 'grid':
+            return await self.grid.get_last_activity(user_id)
+
+        get_stmt = lambda_stmt(lambda: (
             select(Activity)
-            .where(Activity.user_id == user_id)
-            .order_by(Activity.time.desc())
-        )
+            .where(
+                Activity.user_id == user_id,
+                Activity.time == select(User.last_activity_time).where(User.id == user_id).scalar_subquery(),
+            )
+            .limit(1)
+        ))
         result = await self.session.scalars(get_stmt)
         return result.first()
 
-    async def add_activities(self, user_id: int, activities: List[schemas.ActivityBase]) -> None:
+    def select_hours_to_submit(self, user_id: int, current_hour: datetime) -> ScalarSelect:
         """
-        Add list of new activities for user with `user_id`,
+        Build a subquery of UTC hours before `current_hour` which user can fill via activity: hours without
+        activities during the last 24 hours, or since the start of the day for a new user without activities.
+        It is correlated with the row of the user in `users`.
         :param user_id: The user's telegram ID in the database.
-        :param activities: A list of new activities.
+        :param current_hour: UTC hour up to which hours are counted, exclusive.
+        :return: Subquery of an array of hour numbers in chronological order.
         """
-        await self.bulk_add(
-            objs=[Activity(user_id=user_id, **i.model_dump()) for i in activities]
+        one_hour = literal(timedelta(hours=1), Interval)
+        from_hour = case(
+            (User.last_activity_time.is_(None), func.date_trunc('day', cast(current_hour, TIMESTAMP))),
+            else_=cast(current_hour - timedelta(hours=24), TIMESTAMP),
         )
+        series = func.generate_series(
+            from_hour, cast(current_hour - timedelta(hours=1), TIMESTAMP), one_hour
+        ).table_valued('hour').render_derived()
+        hours = self.select_activity_hours(user_id, current_hour - timedelta(hours=24), current_hour)
+        hour_number = func.extract('hour', series.c.hour).cast(Integer)
+        return (
+            select(func.coalesce(
+                func.array_agg(aggregate_order_by(hour_number, series.c.hour)), literal([], ARRAY(Integer))
+            ))
+            .select_from(series)
+            .outerjoin(hours, hours.c.time == series.c.hour)
+            .where(hours.c.time.is_(None))
+            .correlate(User)
+            .scalar_subquery()
+        )
+
+    async def get_context(
+            self, user_id: int, current_hour: Optional[datetime] = None
+    ) -> Optional[Tuple[Optional[int], Optional[List[int]], Optional[Activity], Optional[List[int]]]]:
+        """
+        Get user's data which bot dialogs need on their start in one query: time zone delta, notify hours,
+        last activity and hours which user has to set activities for.
+        :param user_id: The user's telegram ID in the database.
+        :param current_hour: UTC hour up to which hours to submit are counted, see `select_hours_to_submit`.
+            They aren't counted if it isn't given.
+        :return: User time zone delta, notify hours, last activity and UTC hours to submit (None, if
+            `current_hour` isn't given) or None, if there is no such user.
+        """
+        hours_to_submit = (
+            self.select_hours_to_submit(user_id, current_hour) if current_hour is not None else literal(None)
+        )
+        if get_config().db.activity_storage == 'grid':
+            select_stmt = (
+                select(
+                    User.time_zone_delta, User.notify_hours, User.last_activity_time, ActivityDay.slots,
+                    hours_to_submit,
+                )
+                .outerjoin(
+                    ActivityDay,
+                    (ActivityDay.user_id == User.id) & (ActivityDay.day == User.last_activity_time.cast(Date)),
+                )
+                .where(User.id == user_id)
+            )
+            row = (await self.session.execute(select_stmt)).first()
+            if row is None:
+                return None
+
+            tz_delta, notify_hours, time, slots, hours = row
+            last_activity = None
+            if slots is not None:
+                last_activity = Activity(
+                    id=self.grid.get_activity_id(time),
+                    user_id=user_id,
+                    type=ActivityTypes(slots[time.hour]),
+                    time=time,
+                )
+            return tz_delta, notify_hours, last_activity, hours
+
+        select_stmt = lambda_stmt(lambda: (
+            select(User.time_zone_delta, User.notify_hours, Activity)
+            .outerjoin(Activity, (Activity.user_id == User.id) & (Activity.time == User.last_activity_time))
+            .where(User.id == user_id)
+        ))
+        select_stmt += lambda stmt: stmt.add_columns(hours_to_submit)
+        row = (await self.session.execute(select_stmt)).first()
+        if row is None:
+            return None
+
+        tz_delta, notify_hours, last_activity, hours = row
+        return tz_delta, notify_hours, last_activity, hours
+
+    async def add_activities(self, user_id: int, activities: List[schemas.ActivityBase]) -> Tuple[int, int]:
+        """
+        Add list of new activities for user with `user_id`. Activities at hours which already have an activity
+        are skipped. They are written to the storage set by `DBConfig.activity_storage`.
+        :param user_id: The user's telegram ID in the database.
+        :param activities: A list of new activities.
+        :return: Amount of inserted activities and amount of skipped ones.
+        """
+        # The first activity given for an hour wins, as the one already stored in the database does
+        activities_by_time: Dict[datetime, ActivityTypes] = {}
+        for activity in activities:
+            activities_by_time.setdefault(activity.time, activity.type)
+
+        storage = get_config().db.activity_storage
+        inserted: List[Tuple[ActivityTypes, datetime]] = []
+        if storage != 'grid':
+            inserted = await self.add_activity_rows(user_id, activities_by_time)
+        if storage != 'rows':
+            grid_inserted = await self.grid.add_activities(user_id, activities_by_time)
+            if storage == 'grid':
+                inserted = grid_inserted
+
+        if inserted:
+            update_stmt = (
+                update(User)
+                .where(User.id == user_id)
+                .values(
+                    last_activity_time=func.greatest(User.last_activity_time, max(time for _, time in inserted)),
+                    data_version=User.data_version + 1,
+                )
+            )
+            await self.session.execute(update_stmt)
+            await self.add_rollups(user_id, inserted)
+        await self.session.commit()
+
+        return len(inserted), len(activities) - len(inserted)
+
+    async def add_activity_rows(
+            self, user_id: int, activities_by_time: Dict[datetime, ActivityTypes]
+    ) -> List[Tuple[ActivityTypes, datetime]]:
+        """
+        Insert activities into `actions` by multi-row statements without creating ORM objects. Activities at hours
+        which already have an activity are skipped. Doesn't commit.
+        :param user_id: The user's telegram ID in the database.
+        :param activities_by_time: New activities types by their time in UTC.
+        :return: Pairs of activity type and activity time of inserted activities.
+        """
+        values = [dict(user_id=user_id, type=type, time=time) for time, type in activities_by_time.items()]
+        inserted: List[Tuple[ActivityTypes, datetime]] = []
+        for chunk_start in range(0, len(values), self.INSERT_CHUNK_SIZE):
+            insert_stmt = (
+                insert(Activity)
+                .values(values[chunk_start:chunk_start + self.INSERT_CHUNK_SIZE])
+                .on_conflict_do_nothing(index_elements=[Activity.user_id, Activity.time])
+                .returning(Activity.type, Activity.time)
+            )
+            result = await self.session.execute(insert_stmt)
+            inserted.extend(result.tuples().all())
+
+        return inserted
+
+    async def add_rollups(self, user_id: int, activities: List[Tuple[ActivityTypes, datetime]]) -> None:
+        """
+        Add new activities to user's rollups. Doesn't commit, so it runs in the transaction of activities inserting.
+        :param user_id: The user's telegram ID in the database.
+        :param activities: Pairs of activity type and activity time of new activities.
+        """
+        if not activities:
+            return
+
+        increments = get_rollup_increments(user_id, activities)
+        for chunk_start in range(0, len(increments), self.ROLLUP_CHUNK_SIZE):
+            insert_stmt = insert(ActivityRollup).values(increments[chunk_start:chunk_start + self.ROLLUP_CHUNK_SIZE])
+            insert_stmt = insert_stmt.on_conflict_do_update(
+                index_elements=[
+                    ActivityRollup.user_id, ActivityRollup.period, ActivityRollup.period_start, ActivityRollup.type,
+                ],
+                set_=dict(amount=ActivityRollup.amount + insert_stmt.excluded.amount),
+            )
+            await self.session.execute(insert_stmt)
 
     async def update_tz_delta(self, user_id: int, tz_delta: int) -> None:
         """
@@ -140,7 +544,7 @@ class UserRepo(BaseRepo):
         update_stmt = (
             update(User)
             .where(User.id == user_id)
-            .values(time_zone_delta=tz_delta)
+            .values(time_zone_delta=tz_delta, data_version=User.data_version + 1)
         )
 
         await self.session.execute(update_stmt)
@@ -153,36 +557,353 @@ class UserRepo(BaseRepo):
         :param user_id: The user's telegram ID.
         :return: User time zone delta or None.
         """
-        select_stmt = (
+        select_stmt = lambda_stmt(lambda: (
             select(User.time_zone_delta)
             .where(User.id == user_id)
-        )
+        ))
 
         result = await self.session.execute(select_stmt)
         return result.scalar_one()
 
+    async def get_data_version(self, user_id: int) -> Optional[int]:
+        """
+        Get version of user's data, which is incremented by every write of notify hours, time zone delta or
+        activities. Updates of username and language by `create_or_update` don't change it.
+        :param user_id: The user's telegram ID.
+        :return: User's data version or None if user doesn't exist.
+        """
+        select_stmt = lambda_stmt(lambda: (
+            select(User.data_version)
+            .where(User.id == user_id)
+        ))
+
+        result = await self.session.execute(select_stmt)
+        return result.scalar_one_or_none()
+
     async def get_activities_summary(self, user_id: int) -> Sequence[Row[tuple[ActivityTypes, int]]]:
         """
-        Get user's activities summary like [Activity, amount_of_hours].
+        Get user's activities summary like [Activity, amount_of_hours]. It is counted from monthly rollups,
+        so it doesn't depend on the amount of user's activities.
 
         :param user_id: The user's telegram ID.
         :return: User's activities summary.
         """
         select_stmt = (
-            select(Activity.type, func.count(Activity.id))
-            .where(Activity.user_id == user_id)
-            .group_by(Activity.type)
+            select(ActivityRollup.type, func.sum(ActivityRollup.amount))
+            .where(ActivityRollup.user_id == user_id, ActivityRollup.period == RollupPeriods.MONTH)
+            .group_by(ActivityRollup.type)
+        )
+
+        result = await self.session.execute(select_stmt)
+        return result.all()
+
+    def select_activity_hours(self, user_id: int, from_time: datetime, to_time: datetime) -> Subquery:
+        """
+        Build a subquery of user's activities in [from_time, to_time) from the storage set by
+        `DBConfig.activity_storage`. The time range lets the planner prune partitions of `actions`.
+        :param user_id: The user's telegram ID in the database.
+        :param from_time: Start of the time range in UTC.
+        :param to_time: End of the time range in UTC, exclusive.
+        :return: Subquery with columns `time` (in UTC) and `type`.
+        """
+        if get_config().db.activity_storage == 'grid':
+            select_stmt = self.grid.select_activity_hours(user_id, from_time, to_time)
+        else:
+            select_stmt = (
+                select(Activity.time, Activity.type)
+                .where(Activity.user_id == user_id, Activity.time >= from_time, Activity.time < to_time)
+            )
+        return select_stmt.subquery('activity_hours')
+
+    async def get_activities_series(
+            self, user_id: int, tz_delta: int, from_time: datetime, to_time: datetime, granularity: str
+    ) -> Sequence[Row[tuple[datetime, ActivityTypes, int]]]:
+        """
+        Get amount of user's activity hours of every type per time bucket, like [bucket_start, Activity, amount].
+        Buckets are counted in user's local time.
+
+        :param user_id: The user's telegram ID.
+        :param tz_delta: User's time zone delta.
+        :param from_time: Start of the time range in user's local time.
+        :param to_time: End of the time range in user's local time, exclusive.
+        :param granularity: Bucket size, any `date_trunc` field like "day", "week", "month" or "year".
+        :return: User's activities series ordered by bucket start.
+        """
+        tz_shift = timedelta(hours=tz_delta)
+        hours = self.select_activity_hours(user_id, from_time - tz_shift, to_time - tz_shift)
+        bucket_start = func.date_trunc(granularity, hours.c.time + tz_shift).label('bucket_start')
+        select_stmt = (
+            select(bucket_start, hours.c.type, func.count())
+            .group_by(bucket_start, hours.c.type)
+            .order_by(bucket_start)
         )
 
         result = await self.session.execute(select_stmt)
         return result.all()
 
+    async def get_missing_hours(
+            self, user_id: int, from_time: datetime, to_time: datetime
+    ) -> Sequence[Row[tuple[datetime, datetime]]]:
+        """
+        Get hours in [from_time, to_time) which user hasn't set activities for, merged into ranges of consecutive
+        hours. Hours of the time range are generated by `generate_series` and anti-joined with user's activities,
+        which are found by the (user_id, time) index, then consecutive hours are grouped by their offset from
+        their row number.
+
+        :param user_id: The user's telegram ID.
+        :param from_time: Start of the time range in UTC, truncated to hour.
+        :param to_time: End of the time range in UTC, exclusive.
+        :return: Ranges like [start, end) of missing hours in UTC, ordered by start.
+        """
+        one_hour = literal(timedelta(hours=1), Interval)
+        hour = func.generate_series(
+            cast(from_time, TIMESTAMP), cast(to_time - timedelta(hours=1), TIMESTAMP), one_hour
+        ).column_valued('hour')
+        hours = self.select_activity_hours(user_id, from_time, to_time)
+        missing_hours = (
+            select(
+                hour.label('hour'),
+                (hour - func.row_number().over(order_by=hour) * one_hour).label('island'),
+            )
+            .outerjoin(hours, hours.c.time == hour)
+            .where(hours.c.time.is_(None))
+            .subquery()
+        )
+        select_stmt = (
+            select(
+                func.min(missing_hours.c.hour).label('start'),
+                (func.max(missing_hours.c.hour) + one_hour).label('end'),
+            )
+            .group_by(missing_hours.c.island)
+            .order_by('start')
+        )
+
+        result = await self.session.execute(select_stmt)
+        return result.all()
+
+    async def get_activity_slots(self, user_id: int, from_time: datetime, to_time: datetime) -> List[int]:
+        """
+        Get user's activities of every hour in [from_time, to_time) as one flat array, which is aggregated
+        in the database, so a year of hours is fetched as a single value instead of thousands of rows.
+
+        :param user_id: The user's telegram ID.
+        :param from_time: Start of the time range in UTC, truncated to hour.
+        :param to_time: End of the time range in UTC, exclusive.
+        :return: `ActivityTypes` values of hours in chronological order, 0 for hours without activity.
+        """
+        one_hour = literal(timedelta(hours=1), Interval)
+        series = func.generate_series(
+            cast(from_time, TIMESTAMP), cast(to_time - timedelta(hours=1), TIMESTAMP), one_hour
+        ).table_valued('hour').render_derived()
+        hours = self.select_activity_hours(user_id, from_time, to_time)
+        activity_type = Activity.type.type
+        # Values of `ActivityTypes` are positions of the enum labels
+        type_id = func.array_position(
+            func.enum_range(cast(None, activity_type), type_=ARRAY(activity_type)), hours.c.type
+        )
+        select_stmt = (
+            select(func.array_agg(aggregate_order_by(func.coalesce(type_id, 0).cast(SMALLINT), series.c.hour)))
+            .select_from(series)
+            .outerjoin(hours, hours.c.time == series.c.hour)
+        )
+
+        result = await self.session.execute(select_stmt)
+        return result.scalar_one()
+
+    async def stream_activities(
+            self, user_id: int, partition_size: int = 1000
+    ) -> AsyncIterator[Sequence[Row[tuple[datetime, ActivityTypes]]]]:
+        """
+        Stream all user's activities ordered by time through a server-side cursor, so they aren't loaded
+        into memory at once.
+
+        :param user_id: The user's telegram ID.
+        :param partition_size: Amount of activities fetched and yielded at once.
+        :return: Async iterator over partitions of activities like [time, Activity].
+        """
+        hours = self.select_activity_hours(user_id, datetime.min, datetime.max)
+        select_stmt = (
+            select(hours.c.time, hours.c.type)
+            .order_by(hours.c.time)
+            .execution_options(yield_per=partition_size)
+        )
+
+        result = await self.session.stream(select_stmt)
+        async for partition in result.partitions():
+            yield partition
+
+
+class CachedUserRepo(UserRepo):
+    """
+    Users repository which reads rarely changed per-user data through the cache. Values are cached as JSON
+    by keys like "user:<user_id>:<kind>" and invalidated by write methods after their commit. Values read
+    from the database are cached by `CacheBackend.refill`, so a read which overlaps a write doesn't cache
+    the value before the write.
+    """
+
+    def __init__(self, session: AsyncSession, cache: CacheBackend, touches: Optional[UserTouchBuffer] = None):
+        super().__init__(session)
+        self.cache = cache
+        self.touches = touches
+
+    @staticmethod
+    def get_key(user_id: int, kind: str) -> str:
+        return f'user:{user_id}:{kind}'
+
+    @staticmethod
+    def dump_activity(activity: Optional[Activity]) -> Optional[dict]:
+        if activity is None:
+            return None
+        return dict(id=activity.id, type=activity.type.value, time=activity.time.isoformat())
+
+    @staticmethod
+    def load_activity(user_id: int, data: Optional[dict]) -> Optional[Activity]:
+        if data is None:
+            return None
+        return Activity(
+            id=data['id'],
+            user_id=user_id,
+            type=ActivityTypes(data['type']),
+            time=datetime.fromisoformat(data['time']),
+        )
+
+    async def create_or_update(
+            self, user_id: int, language: str, username: Optional[str] = None
+    ) -> Tuple[Union[Row, User], bool]:
+        """
+        Creates or updates user. Users who aren't cached are upserted right away, so new users are detected
+        synchronously. Updates of cached users are only buffered in `touches`, if it's given.
+        """
+        key = self.get_key(user_id, 'user')
+        cached = await self.cache.get(key) if self.touches is not None else MISSING
+        if cached is MISSING:
+            user, is_created = await super().create_or_update(user_id, language, username)
+            await self.cache.refill(key, dict(
+                id=user.id,
+                username=user.username,
+                language=user.language,
+                notify_hours=user.notify_hours,
+                time_zone_delta=user.time_zone_delta,
+            ))
+            return user, is_created
+
+        self.touches.touch(user_id, username, language)
+        if (cached['username'], cached['language']) != (username, language):
+            cached.update(username=username, language=language)
+            await self.cache.set(key, cached)
+        return User(**cached), False
+
+    async def create_or_update_many(self, users: List[schemas.UserBase]) -> List[Row]:
+        rows = await super().create_or_update_many(users)
+        if rows:
+            await self.cache.delete(*(self.get_key(row.id, 'user') for row in rows))
+        return rows
+
+    async def update_notify_hours(self, user_id: int, new_hours: List[int]) -> None:
+        await super().update_notify_hours(user_id, new_hours)
+        await self.cache.delete(*(
+            self.get_key(user_id, kind) for kind in ('notify_hours', 'context', 'user', 'data_version')
+        ))
+
+    async def get_notify_hours(self, user_id: int) -> Optional[List[int]]:
+        key = self.get_key(user_id, 'notify_hours')
+        notify_hours = await self.cache.get(key)
+        if notify_hours is MISSING:
+            notify_hours = await super().get_notify_hours(user_id)
+            await self.cache.refill(key, notify_hours)
+        return notify_hours
+
+    async def update_tz_delta(self, user_id: int, tz_delta: int) -> None:
+        await super().update_tz_delta(user_id, tz_delta)
+        await self.cache.delete(*(
+            self.get_key(user_id, kind) for kind in ('tz_delta', 'context', 'user', 'data_version')
+        ))
+
+    async def get_tz_delta(self, user_id: int) -> Optional[int]:
+        key = self.get_key(user_id, 'tz_delta')
+        tz_delta = await self.cache.get(key)
+        if tz_delta is MISSING:
+            tz_delta = await super().get_tz_delta(user_id)
+            await self.cache.refill(key, tz_delta)
+        return tz_delta
+
+    async def add_activities(self, user_id: int, activities: List[schemas.ActivityBase]) -> Tuple[int, int]:
+        inserted, skipped = await super().add_activities(user_id, activities)
+        if inserted:
+            await self.cache.delete(*(
+                self.get_key(user_id, kind) for kind in ('last_activity', 'summary', 'context', 'data_version')
+            ))
+        return inserted, skipped
+
+    async def get_last_activity(self, user_id: int) -> Optional[Activity]:
+        key = self.get_key(user_id, 'last_activity')
+        cached = await self.cache.get(key)
+        if cached is MISSING:
+            activity = await super().get_last_activity(user_id)
+            await self.cache.refill(key, self.dump_activity(activity))
+            return activity
+
+        return self.load_activity(user_id, cached)
+
+    async def get_context(
+            self, user_id: int, current_hour: Optional[datetime] = None
+    ) -> Optional[Tuple[Optional[int], Optional[List[int]], Optional[Activity], Optional[List[int]]]]:
+        key = self.get_key(user_id, 'context')
+        cached = await self.cache.get(key)
+        # Hours to submit are cached with the hour they were counted up to, they are outdated in the next hour
+        hour = current_hour.isoformat() if current_hour is not None else None
+        if cached is MISSING or (hour is not None and cached[3] != hour):
+            context = await super().get_context(user_id, current_hour)
+            if context is not None:
+                tz_delta, notify_hours, activity, hours_to_submit = context
+                await self.cache.refill(
+                    key, [tz_delta, notify_hours, self.dump_activity(activity), hour, hours_to_submit]
+                )
+            return context
+
+        tz_delta, notify_hours, activity, _, hours_to_submit = cached
+        return tz_delta, notify_hours, self.load_activity(user_id, activity), hours_to_submit if hour else None
+
+    async def get_data_version(self, user_id: int) -> Optional[int]:
+        key = self.get_key(user_id, 'data_version')
+        data_version = await self.cache.get(key)
+        if data_version is MISSING:
+            data_version = await super().get_data_version(user_id)
+            await self.cache.refill(key, data_version)
+        return data_version
+
+    async def get_activities_summary(self, user_id: int) -> Sequence[Tuple[ActivityTypes, int]]:
+        key = self.get_key(user_id, 'summary')
+        cached = await self.cache.get(key)
+        if cached is MISSING:
+            summary = await super().get_activities_summary(user_id)
+            await self.cache.refill(key, [(activity_type.value, amount) for activity_type, amount in summary])
+            return summary
+
+        return [(ActivityTypes(activity_type), amount) for activity_type, amount in cached]
+
 
 class DatabaseRepo(BaseRepo):
     """
     Repository for handling database operations. This class holds all the repositories for the database models.
     """
 
+    def __init__(
+            self,
+            session: AsyncSession,
+            cache: Optional[CacheBackend] = None,
+            touches: Optional[UserTouchBuffer] = None,
+    ):
+        super().__init__(session)
+        self.cache = cache
+        self.touches = touches
+
     @property
     def users(self) -> UserRepo:
+        if self.cache is not None:
+            return CachedUserRepo(self.session, self.cache, self.touches)
         return UserRepo(self.session)
+
+    @property
+    def activity_days(self) -> ActivityGridRepo:
+        return ActivityGridRepo(self.session)
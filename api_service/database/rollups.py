@@ -0,0 +1,143 @@
+"""
+Helpers for the `user_activity_rollups` table and the command to backfill it from existing activities.
+
+Backfill rollups in chunks of users (run from the `api_service` directory):
+    python -m database.rollups --chunk-size 500
+"""
+import argparse
+import asyncio
+from collections import Counter
+from datetime import datetime, date, timedelta
+from typing import Iterable, Tuple, List, Dict, Any
+
+from loguru import logger
+from sqlalchemy import select, func, literal, Date, Subquery
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import get_config
+
+from .models import Activity, ActivityRollup, ActivityTypes, RollupPeriods, User
+
+
+def get_period_start(period: RollupPeriods, time: datetime) -> date:
+    """
+    Get the first day of the rollup period which includes `time`.
+
+    :param period: The rollup period.
+    :param time: Activity time in UTC.
+    :return: Start date of the period.
+    """
+    day = time.date()
+    if period is RollupPeriods.WEEK:
+        return day - timedelta(days=day.weekday())
+    if period is RollupPeriods.MONTH:
+        return day.replace(day=1)
+    return day
+
+
+def get_rollup_increments(user_id: int, activities: Iterable[Tuple[ActivityTypes, datetime]]) -> List[Dict[str, Any]]:
+    """
+    Count new activities by every rollup period, to add these amounts to the user's rollups.
+
+    :param user_id: The user's telegram ID.
+    :param activities: Pairs of activity type and activity time of new activities.
+    :return: List of rollup rows values.
+    """
+    counter: Counter[Tuple[RollupPeriods, date, ActivityTypes]] = Counter()
+    for activity_type, time in activities:
+        for period in RollupPeriods:
+            counter[(period, get_period_start(period, time), activity_type)] += 1
+
+    return [
+        dict(user_id=user_id, period=period, period_start=period_start, type=activity_type, amount=amount)
+        for (period, period_start, activity_type), amount in counter.items()
+    ]
+
+
+def select_users_activities(from_user_id: int, to_user_id: int) -> Subquery:
+    """
+    Build a subquery of all activities of users with IDs in range [from_user_id, to_user_id] from the storage set
+    by `DBConfig.activity_storage`.
+
+    :param from_user_id: The first user's telegram ID of the range.
+    :param to_user_id: The last user's telegram ID of the range.
+    :return: Subquery with columns `user_id`, `time` (in UTC) and `type`.
+    """
+    from .repositories import ActivityGridRepo
+
+    if get_config().db.activity_storage == 'grid':
+        select_stmt = ActivityGridRepo.select_users_activity_hours(from_user_id, to_user_id)
+    else:
+        select_stmt = (
+            select(Activity.user_id, Activity.time, Activity.type)
+            .where(Activity.user_id.between(from_user_id, to_user_id))
+        )
+    return select_stmt.subquery('activity_hours')
+
+
+async def rebuild_rollups(session: AsyncSession, from_user_id: int, to_user_id: int) -> None:
+    """
+    Recount rollups from activities of users with IDs in range [from_user_id, to_user_id] and commit them.
+
+    :param session: Session to the database.
+    :param from_user_id: The first user's telegram ID of the range.
+    :param to_user_id: The last user's telegram ID of the range.
+    """
+    hours = select_users_activities(from_user_id, to_user_id)
+    for period in RollupPeriods:
+        period_start = func.date_trunc(period.value, hours.c.time).cast(Date)
+        select_stmt = (
+            select(
+                hours.c.user_id,
+                literal(period, ActivityRollup.period.type),
+                period_start,
+                hours.c.type,
+                func.count(),
+            )
+            .group_by(hours.c.user_id, period_start, hours.c.type)
+        )
+        insert_stmt = insert(ActivityRollup).from_select(
+            ['user_id', 'period', 'period_start', 'type', 'amount'], select_stmt
+        )
+        insert_stmt = insert_stmt.on_conflict_do_update(
+            index_elements=[
+                ActivityRollup.user_id, ActivityRollup.period, ActivityRollup.period_start, ActivityRollup.type,
+            ],
+            set_=dict(amount=insert_stmt.excluded.amount),
+        )
+        await session.execute(insert_stmt)
+    await session.commit()
+
+
+async def backfill(chunk_size: int) -> None:
+    """ Rebuild rollups of every user, taking `chunk_size` users per transaction. """
+    from .session_manager import session_manager
+
+    session_manager.init()
+    last_user_id, users_done = 0, 0
+    async with session_manager.create_session() as session:
+        while True:
+            select_stmt = (
+                select(User.id)
+                .where(User.id > last_user_id)
+                .order_by(User.id)
+                .limit(chunk_size)
+            )
+            user_ids = (await session.scalars(select_stmt)).all()
+            if not user_ids:
+                break
+
+            await rebuild_rollups(session, user_ids[0], user_ids[-1])
+            last_user_id = user_ids[-1]
+            users_done += len(user_ids)
+            logger.info(f'Rollups have been rebuilt for {users_done} users (last user ID: {last_user_id})')
+    await session_manager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunk-size', type=int, default=500, help='Amount of users rebuilt in one transaction.')
+    args = parser.parse_args()
+
+    asyncio.run(backfill(args.chunk_size))
@@ -1,7 +1,15 @@
+import asyncio
+import time
 from contextlib import asynccontextmanager
-from typing import Optional, AsyncIterator
+from itertools import count
+from typing import Optional, AsyncIterator, Dict, Any, Sequence, List
+
+from loguru import logger
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession, AsyncEngine, AsyncConnection
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
+import metrics
 from config import get_config
 
 
@@ -13,37 +21,155 @@ class SessionManagerNotInitialized(Exception):
         super().__init__(msg)
 
 
-class AsyncDBSessionManager:
-    """ Class for async connection to database """
+class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+    """ Queue pool which also records how long checkouts wait for a connection """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts: int = 0
+        self.wait_time: float = 0
+        self.max_wait_time: float = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            wait_time = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+            metrics.DB_POOL_WAIT_DURATION.observe(wait_time)
 
-    def __init__(self, db_url: str, expire_on_commit: bool = True, autoflush: bool = True):
+
+class AsyncDBSessionManager:
+    """
+    Class for async connection to database. Besides the primary it can hold read replicas: read-only sessions
+    are opened on a healthy replica by turns, or on the primary if no replica is healthy at the moment.
+    """
+    # Replication lag in seconds: 0 if the replica streams from the primary and has replayed everything received,
+    # otherwise time since the last replayed transaction. 0 on a server which isn't a replica (anymore)
+    REPLICA_LAG_QUERY: str = (
+        "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+        "WHEN EXISTS (SELECT FROM pg_stat_wal_receiver WHERE status = 'streaming') "
+        "AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+        "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+    )
+
+    def __init__(
+            self,
+            db_url: str,
+            engine_settings: Optional[Dict[str, Any]] = None,
+            expire_on_commit: bool = True,
+            autoflush: bool = True,
+            replica_urls: Sequence[str] = (),
+            replica_max_lag: float = 10,
+    ):
         self.db_url = db_url
+        self.replica_urls = list(replica_urls)
+        self.replica_max_lag = replica_max_lag
         self.session_settings = {
             'expire_on_commit': expire_on_commit,
             'autoflush': autoflush,
         }
-        self.engine_settings = {}
+        self.engine_settings = engine_settings or {}
 
         self._engine: Optional[AsyncEngine] = None
         self._session_maker: Optional[async_sessionmaker[AsyncSession]] = None
-        self.init()
+        self._replica_engines: List[AsyncEngine] = []
+        self._replica_session_makers: List[async_sessionmaker[AsyncSession]] = []
+        # Indexes of replicas which passed the last health check. Until the first check only the primary is used
+        self._healthy_replicas: List[int] = []
+        self._replica_turns = count()
 
     def init(self):
-        """ Initialize session manager. Create async engine and async session maker """
-        self._engine = create_async_engine(self.db_url, connect_args=self.engine_settings)
+        """
+        Initialize session manager. Create async engine and async session maker. It has to be called in the process
+        which uses the engine (i.e. in lifespan of every worker), because connections can't be shared between
+        processes. If it is already initialized, nothing is done, so there is only one engine per process.
+        """
+        from .monitoring import instrument_engine
+
+        if self._engine is not None:
+            return
+        self._engine = create_async_engine(self.db_url, poolclass=TimedAsyncAdaptedQueuePool, **self.engine_settings)
+        instrument_engine(self._engine.sync_engine)
         self._session_maker = async_sessionmaker(self._engine, **self.session_settings)
+        for replica_url in self.replica_urls:
+            engine = create_async_engine(replica_url, poolclass=TimedAsyncAdaptedQueuePool, **self.engine_settings)
+            instrument_engine(engine.sync_engine)
+            self._replica_engines.append(engine)
+            self._replica_session_makers.append(async_sessionmaker(engine, **self.session_settings))
 
     def raise_if_not_initialized(self) -> None:
         """ Check, if instance was initialized. If not, raise error """
         if self._engine is None or self._session_maker is None:
             raise SessionManagerNotInitialized
 
+    def pool_stats(self) -> Dict[str, Any]:
+        """ Return current state of the connection pool and how long checkouts have waited for connections """
+        self.raise_if_not_initialized()
+        pool: TimedAsyncAdaptedQueuePool = self._engine.pool
+        return {
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),  # Negative while the pool isn't filled up to its size
+            'checkouts': pool.checkouts,
+            'wait_time_total': pool.wait_time,
+            'wait_time_max': pool.max_wait_time,
+        }
+
+    async def get_replica_lag(self, replica_index: int, timeout: float) -> float:
+        """ Return replication lag of the replica in seconds, +inf if it doesn't answer in `timeout` seconds. """
+        async def query_lag() -> Optional[float]:
+            async with self._replica_engines[replica_index].connect() as connection:
+                return (await connection.execute(text(self.REPLICA_LAG_QUERY))).scalar()
+
+        try:
+            lag = await asyncio.wait_for(query_lag(), timeout)
+        except Exception as e:
+            if replica_index in self._healthy_replicas:
+                logger.warning(f"Replica {replica_index} isn't used until it is reachable: {e!r}")
+            return float('inf')
+        return float(lag or 0)
+
+    async def check_replicas(self, timeout: float = 5) -> None:
+        """ Check lag of every replica and keep only replicas which lag less than `replica_max_lag` in use. """
+        self.raise_if_not_initialized()
+
+        lags = await asyncio.gather(*(
+            self.get_replica_lag(replica_index, timeout) for replica_index in range(len(self._replica_engines))
+        ))
+        healthy_replicas = []
+        for replica_index, lag in enumerate(lags):
+            metrics.DB_REPLICA_LAG.labels(replica=replica_index).set(lag)
+            if lag <= self.replica_max_lag:
+                healthy_replicas.append(replica_index)
+            elif replica_index in self._healthy_replicas and lag != float('inf'):
+                logger.warning(f"Replica {replica_index} isn't used until it catches up, its lag is {lag:.1f}s")
+        for replica_index in set(healthy_replicas) - set(self._healthy_replicas):
+            logger.info(f"Replica {replica_index} is used for reading")
+        self._healthy_replicas = healthy_replicas
+
+    async def run_replicas_health_check(self, interval: float) -> None:
+        """ Check replicas every `interval` seconds, forever. Started as a background task of API service. """
+        while True:
+            try:
+                await self.check_replicas(timeout=interval)
+            except Exception:
+                logger.exception("Unable to check replicas")
+            await asyncio.sleep(interval)
+
     async def close(self):
-        """ Dispose engine and close all connection """
+        """ Dispose engines and close all connections """
         self.raise_if_not_initialized()
         await self._engine.dispose()
+        for engine in self._replica_engines:
+            await engine.dispose()
         self._engine = None
         self._session_maker = None
+        self._replica_engines, self._replica_session_makers, self._healthy_replicas = [], [], []
 
     @asynccontextmanager
     async def create_connect(self) -> AsyncIterator[AsyncConnection]:
@@ -71,5 +197,35 @@ class AsyncDBSessionManager:
         finally:
             await session.close()
 
+    @asynccontextmanager
+    async def create_readonly_session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Create session for reading on a healthy replica, or on the primary if there is none. Data read by it
+        may lag behind the primary up to `replica_max_lag` seconds, so it shouldn't be used for writing or
+        for reads which the same client has just written.
+        """
+        self.raise_if_not_initialized()
+
+        healthy_replicas = self._healthy_replicas
+        if not healthy_replicas:
+            async with self.create_session() as session:
+                yield session
+            return
+
+        replica_index = healthy_replicas[next(self._replica_turns) % len(healthy_replicas)]
+        session = self._replica_session_makers[replica_index]()
+        try:
+            yield session
+        except Exception as exc:
+            await session.rollback()
+            raise exc
+        finally:
+            await session.close()
+
 
-session_manager = AsyncDBSessionManager(db_url=get_config().db.url)
+session_manager = AsyncDBSessionManager(
+    db_url=get_config().db.url,
+    engine_settings=get_config().db.get_engine_settings(workers=get_config().api.workers),
+    replica_urls=[str(replica_url) for replica_url in get_config().db.replica_urls],
+    replica_max_lag=get_config().db.replica_max_lag,
+)
@@ -1,16 +0,0 @@
-from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine, AsyncEngine, AsyncSession
-
-
-def create_engine(database_dsn: str, echo=False) -> AsyncEngine:
-    return create_async_engine(
-        database_dsn,
-        query_cache_size=1200,
-        pool_size=20,
-        max_overflow=200,
-        future=True,
-        echo=echo,
-    )
-
-
-def create_session_pool(engine) -> async_sessionmaker[AsyncSession]:
-    return async_sessionmaker(bind=engine, expire_on_commit=False)
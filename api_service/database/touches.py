@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, Tuple
+
+from loguru import logger
+
+from config import get_config
+from .session_manager import session_manager
+
+# Username, language and time of the last touch of a user
+Touch = Tuple[str, str, datetime]
+
+
+class UserTouchBuffer:
+    """
+    Write-behind buffer of touches of known users (username, language and `last_activity` updates).
+    Touches of a user are coalesced in memory and flushed as one multi-row upsert every `flush_interval` seconds
+    or as soon as `flush_size` users are touched, so writes to `users` scale with active users per flush window.
+    """
+
+    def __init__(self, flush_interval: float, flush_size: int):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._touches: Dict[int, Touch] = {}
+        self._full = asyncio.Event()
+
+    def touch(self, user_id: int, username: str, language: str) -> None:
+        """
+        Remember the touch of user to write it by the next flush. The last touch of a user wins.
+        :param user_id: The user's telegram ID.
+        :param username: The user's username.
+        :param language: The user's language.
+        """
+        self._touches[user_id] = (username, language, datetime.utcnow())
+        if len(self._touches) >= self.flush_size:
+            self._full.set()
+
+    async def flush(self) -> int:
+        """
+        Write buffered touches to the database. If writing fails, touches are returned to the buffer unless
+        there are newer ones of the same users.
+        :return: Amount of flushed users.
+        """
+        from .repositories import UserRepo
+
+        touches, self._touches = self._touches, {}
+        self._full.clear()
+        if not touches:
+            return 0
+
+        try:
+            async with session_manager.create_session() as session:
+                await UserRepo(session).touch_many(touches)
+        except BaseException:  # Also when the flush is cancelled on shutdown, so the final flush writes them
+            self._touches = touches | self._touches
+            raise
+        return len(touches)
+
+    async def run(self) -> None:
+        """ Flush touches every `flush_interval` seconds or when the buffer is full, until cancelled. """
+        self._full = asyncio.Event()  # Bind the event to the loop which runs the flushes
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Failed to flush user touches')
+
+
+touch_buffer = UserTouchBuffer(
+    flush_interval=get_config().db.touches_flush_interval,
+    flush_size=get_config().db.touches_flush_size,
+)
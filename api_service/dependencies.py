@@ -1,7 +1,62 @@
+from datetime import datetime
+from typing import Callable, Dict, Optional, Awaitable
+
+from fastapi import Depends, Header, HTTPException, status
+
+import schemas
+from cache import get_cache
+from config import get_config
 from database.session_manager import session_manager
 from database.repositories import DatabaseRepo
+from database.touches import touch_buffer
 
 
 async def get_db():
     async with session_manager.create_session() as session:
+        yield DatabaseRepo(
+            session=session,
+            cache=get_cache(),
+            touches=touch_buffer if get_config().db.touches_write_behind else None,
+        )
+
+
+async def get_db_readonly():
+    """
+    Repository for read-only routes, which may read from a replica. It doesn't use the cache, because values
+    read from a lagging replica could overwrite the cache right after their invalidation by a write.
+    """
+    async with session_manager.create_readonly_session() as session:
         yield DatabaseRepo(session=session)
+
+
+def check_data_version(
+        get_repo: Callable = get_db, hourly: bool = False
+) -> Callable[..., Awaitable[Dict[str, str]]]:
+    """
+    Create dependency for conditional GET of user's data. It reads user's data version before the route runs
+    its query and answers 304 if the version matches `If-None-Match` header. Otherwise, it returns headers with
+    the version as `ETag`, which the route has to set on its response.
+    :param get_repo: Dependency of repository which the route reads by, so the version is read from the same
+        database (a replica may lag behind the primary).
+    :param hourly: Whether the response depends on the current hour too, then the hour is a part of the ETag.
+    :return: Dependency which returns headers of the response.
+    """
+    async def dependency(
+            user_id: schemas.TelegramUserId,
+            if_none_match: Optional[str] = Header(default=None),
+            db: DatabaseRepo = Depends(get_repo),
+    ) -> Dict[str, str]:
+        data_version = await db.users.get_data_version(user_id)
+        if data_version is None:
+            return {}
+
+        etag = f'"{data_version}-{datetime.utcnow():%Y%m%d%H}"' if hourly else f'"{data_version}"'
+        # Clients have to revalidate the response every time, and they get 304 without body if nothing changed
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if if_none_match is not None:
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+            if etag in tags or '*' in tags:
+                raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return headers
+
+    return dependency
@@ -0,0 +1,96 @@
+"""
+Prometheus metrics of the API. They are served by `GET /metrics`.
+
+With several workers every worker has its own metrics, so set `PROMETHEUS_MULTIPROC_DIR` environment variable
+to an empty directory before start: then workers write metrics there and `/metrics` of any worker serves them all.
+"""
+import os
+import time
+
+from prometheus_client import Histogram, Gauge, CollectorRegistry, REGISTRY, generate_latest, multiprocess
+from starlette.routing import Match
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+
+# Label of requests which don't match any route, so scans of random paths don't create new series
+UNMATCHED_ROUTE: str = 'unmatched'
+
+REQUEST_DURATION = Histogram(
+    'api_request_duration_seconds',
+    'Duration of requests by route',
+    ['method', 'route', 'status'],
+    buckets=(.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5, 10),
+)
+REQUESTS_IN_PROGRESS = Gauge(
+    'api_requests_in_progress',
+    'Requests which are being processed by route',
+    ['method', 'route'],
+    multiprocess_mode='livesum',
+)
+DB_STATEMENT_DURATION = Histogram(
+    'api_db_statement_duration_seconds',
+    'Duration of database statements by repository method which executes them',
+    ['method'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5),
+)
+DB_POOL_WAIT_DURATION = Histogram(
+    'api_db_pool_wait_seconds',
+    'Time requests wait for a free connection of the pool',
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 30),
+)
+DB_REPLICA_LAG = Gauge(
+    'api_db_replica_lag_seconds',
+    'Replication lag of read replicas by their index in config, +Inf if a replica is unreachable',
+    ['replica'],
+    multiprocess_mode='livemax',
+)
+
+
+def get_metrics() -> bytes:
+    """ Return metrics in Prometheus text format. """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_worker_dead() -> None:
+    """ Remove live gauges of this worker from metrics of all workers on shutdown. """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+class MetricsMiddleware:
+    """ ASGI middleware which records duration and amount of in-progress requests by route template. """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    def get_route(self, scope: Scope) -> str:
+        for route in scope['app'].routes:
+            match, _ = route.matches(scope)
+            if match is Match.FULL:
+                return route.path
+        return UNMATCHED_ROUTE
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        method, route, status = scope['method'], self.get_route(scope), 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        in_progress = REQUESTS_IN_PROGRESS.labels(method=method, route=route)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUEST_DURATION.labels(method=method, route=route, status=status).observe(time.perf_counter() - start)
+            in_progress.dec()
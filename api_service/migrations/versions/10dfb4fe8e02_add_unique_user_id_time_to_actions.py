@@ -0,0 +1,40 @@
+"""Add unique user_id and time to actions
+
+Revision ID: 10dfb4fe8e02
+Revises: 6971fcc2c16a
+Create Date: 2026-10-17 12:37:52.690415
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '10dfb4fe8e02'
+down_revision: Union[str, None] = '6971fcc2c16a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep only the first created activity of every hour.
+    # If something is deleted here, rebuild rollups with `python -m database.rollups`
+    op.execute(
+        """
+        DELETE FROM actions AS duplicate
+        USING actions AS original
+        WHERE duplicate.user_id = original.user_id
+          AND duplicate.time = original.time
+          AND duplicate.id > original.id
+        """
+    )
+    op.create_unique_constraint('uq_actions_user_id_time', 'actions', ['user_id', 'time'])
+    # Unique constraint index covers the same lookups, Postgres can scan it backward
+    op.drop_index('ix_actions_user_id_time', table_name='actions')
+
+
+def downgrade() -> None:
+    op.create_index('ix_actions_user_id_time', 'actions', ['user_id', sa.text('time DESC')])
+    op.drop_constraint('uq_actions_user_id_time', 'actions', type_='unique')
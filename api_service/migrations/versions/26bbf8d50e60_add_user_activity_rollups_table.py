@@ -0,0 +1,37 @@
+"""Add user activity rollups table
+
+Revision ID: 26bbf8d50e60
+Revises: e5d04fcfaa1f
+Create Date: 2026-10-17 11:03:17.208841
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '26bbf8d50e60'
+down_revision: Union[str, None] = 'e5d04fcfaa1f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('user_activity_rollups',
+    sa.Column('user_id', sa.BIGINT(), nullable=False),
+    sa.Column('period', sa.Enum('DAY', 'WEEK', 'MONTH', name='rollupperiods'), nullable=False),
+    sa.Column('period_start', sa.Date(), nullable=False),
+    sa.Column('type', postgresql.ENUM(name='activitytypes', create_type=False), nullable=False),
+    sa.Column('amount', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'period', 'period_start', 'type')
+    )
+    # Rollups for existing activities are built by `python -m database.rollups`
+
+
+def downgrade() -> None:
+    op.drop_table('user_activity_rollups')
+    sa.Enum(name='rollupperiods').drop(op.get_bind())
@@ -0,0 +1,39 @@
+"""Add user notify schedule table
+
+Revision ID: 6971fcc2c16a
+Revises: 26bbf8d50e60
+Create Date: 2026-10-17 11:48:05.117930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6971fcc2c16a'
+down_revision: Union[str, None] = '26bbf8d50e60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('user_notify_schedule',
+    sa.Column('hour', sa.SMALLINT(), nullable=False),
+    sa.Column('user_id', sa.BIGINT(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('hour', 'user_id')
+    )
+    op.execute(
+        """
+        INSERT INTO user_notify_schedule (hour, user_id)
+        SELECT DISTINCT unnest(notify_hours), id
+        FROM users
+        WHERE notify_hours IS NOT NULL
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_notify_schedule')
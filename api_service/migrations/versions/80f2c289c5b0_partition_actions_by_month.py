@@ -0,0 +1,87 @@
+"""Partition actions by month
+
+Revision ID: 80f2c289c5b0
+Revises: 10dfb4fe8e02
+Create Date: 2026-10-17 13:54:09.381276
+
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '80f2c289c5b0'
+down_revision: Union[str, None] = '10dfb4fe8e02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+
+def next_month(month_start: date) -> date:
+    return date(month_start.year + month_start.month // 12, month_start.month % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE actions RENAME TO actions_old")
+    op.execute("ALTER TABLE actions_old RENAME CONSTRAINT actions_pkey TO actions_old_pkey")
+    op.execute("ALTER TABLE actions_old RENAME CONSTRAINT uq_actions_user_id_time TO uq_actions_old_user_id_time")
+    op.execute(
+        """
+        CREATE TABLE actions (
+            id INTEGER NOT NULL DEFAULT nextval('actions_id_seq'),
+            user_id BIGINT NOT NULL,
+            type activitytypes NOT NULL,
+            time TIMESTAMP NOT NULL,
+            CONSTRAINT actions_pkey PRIMARY KEY (id, time),
+            CONSTRAINT uq_actions_user_id_time UNIQUE (user_id, time),
+            CONSTRAINT actions_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)
+        ) PARTITION BY RANGE (time)
+        """
+    )
+    op.execute("ALTER SEQUENCE actions_id_seq OWNED BY actions.id")
+
+    # Catches activities older than the first partition, so inserting them doesn't fail
+    op.execute("CREATE TABLE actions_default PARTITION OF actions DEFAULT")
+
+    first_time = op.get_bind().execute(sa.text("SELECT MIN(time) FROM actions_old")).scalar()
+    month_start = (first_time or datetime.utcnow()).date().replace(day=1)
+    last_month_start = datetime.utcnow().date().replace(day=1)
+    for _ in range(MONTHS_AHEAD):
+        last_month_start = next_month(last_month_start)
+    while month_start <= last_month_start:
+        op.execute(
+            f"CREATE TABLE actions_y{month_start.year}m{month_start.month:02d} PARTITION OF actions "
+            f"FOR VALUES FROM ('{month_start.isoformat()}') TO ('{next_month(month_start).isoformat()}')"
+        )
+        month_start = next_month(month_start)
+
+    op.execute("INSERT INTO actions (id, user_id, type, time) SELECT id, user_id, type, time FROM actions_old")
+    op.execute("DROP TABLE actions_old")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE actions RENAME TO actions_partitioned")
+    op.execute("ALTER TABLE actions_partitioned RENAME CONSTRAINT actions_pkey TO actions_partitioned_pkey")
+    op.execute(
+        "ALTER TABLE actions_partitioned RENAME CONSTRAINT uq_actions_user_id_time TO uq_actions_partitioned_user_id_time"
+    )
+    op.execute(
+        """
+        CREATE TABLE actions (
+            id INTEGER NOT NULL DEFAULT nextval('actions_id_seq'),
+            user_id BIGINT NOT NULL,
+            type activitytypes NOT NULL,
+            time TIMESTAMP NOT NULL,
+            CONSTRAINT actions_pkey PRIMARY KEY (id),
+            CONSTRAINT uq_actions_user_id_time UNIQUE (user_id, time),
+            CONSTRAINT actions_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+        """
+    )
+    op.execute("ALTER SEQUENCE actions_id_seq OWNED BY actions.id")
+    op.execute("INSERT INTO actions (id, user_id, type, time) SELECT id, user_id, type, time FROM actions_partitioned")
+    op.execute("DROP TABLE actions_partitioned")
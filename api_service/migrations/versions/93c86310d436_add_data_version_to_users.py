@@ -0,0 +1,26 @@
+"""Add data version to users
+
+Revision ID: 93c86310d436
+Revises: b22235c82ff7
+Create Date: 2026-10-17 21:20:37.418265
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '93c86310d436'
+down_revision: Union[str, None] = 'b22235c82ff7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('data_version', sa.BIGINT(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'data_version')
@@ -0,0 +1,43 @@
+"""Add activity days table
+
+Revision ID: b22235c82ff7
+Revises: 80f2c289c5b0
+Create Date: 2026-10-17 15:21:44.902113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b22235c82ff7'
+down_revision: Union[str, None] = '80f2c289c5b0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('activity_days',
+    sa.Column('user_id', sa.BIGINT(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('slots', sa.ARRAY(sa.SMALLINT(), dimensions=1), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'day')
+    )
+    # Fills empty (0) slots of the old day with the new ones, slots which are already set are kept
+    op.execute(
+        """
+        CREATE FUNCTION merge_activity_slots(old_slots SMALLINT[], new_slots SMALLINT[]) RETURNS SMALLINT[]
+        LANGUAGE sql IMMUTABLE AS $$
+            SELECT array_agg(CASE WHEN old_slot <> 0 THEN old_slot ELSE new_slot END ORDER BY hour)
+            FROM unnest(old_slots, new_slots) WITH ORDINALITY AS slots(old_slot, new_slot, hour)
+        $$
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP FUNCTION merge_activity_slots(SMALLINT[], SMALLINT[])")
+    op.drop_table('activity_days')
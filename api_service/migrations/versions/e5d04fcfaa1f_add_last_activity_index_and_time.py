@@ -0,0 +1,36 @@
+"""Add last activity index and time
+
+Revision ID: e5d04fcfaa1f
+Revises: ce55c6ad0783
+Create Date: 2026-10-17 10:12:41.532104
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5d04fcfaa1f'
+down_revision: Union[str, None] = 'ce55c6ad0783'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_actions_user_id_time', 'actions', ['user_id', sa.text('time DESC')])
+    op.add_column('users', sa.Column('last_activity_time', sa.TIMESTAMP(), nullable=True))
+    op.execute(
+        """
+        UPDATE users
+        SET last_activity_time = last_actions.time
+        FROM (SELECT user_id, MAX(time) AS time FROM actions GROUP BY user_id) AS last_actions
+        WHERE users.id = last_actions.user_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_column('users', 'last_activity_time')
+    op.drop_index('ix_actions_user_id_time', table_name='actions')
@@ -1,8 +1,10 @@
-from . import healthcheck, users
+from . import healthcheck, users, stats, metrics
 
 routers_list = [
     healthcheck.router,
     users.router,
+    stats.router,
+    metrics.router,
 ]
 
 __all__ = [
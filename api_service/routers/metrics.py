@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Response
+from prometheus_client import CONTENT_TYPE_LATEST
+
+from metrics import get_metrics
+
+router = APIRouter(tags=['metrics'])
+
+
+@router.get(
+    '/metrics',
+    summary="Prometheus metrics",
+    description="Request durations by route, requests in progress, database statement durations by repository "
+                "method and pool wait time in Prometheus text format.",
+    response_class=Response,
+)
+def get_prometheus_metrics() -> Response:
+    return Response(content=get_metrics(), media_type=CONTENT_TYPE_LATEST)
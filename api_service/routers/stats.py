@@ -0,0 +1,30 @@
+from fastapi import APIRouter
+
+import schemas
+from cache import get_cache
+from config import get_config
+from database.session_manager import session_manager
+
+router = APIRouter(prefix='/stats', tags=['stats'])
+
+
+@router.get(
+    '/pool',
+    summary="Database connection pool stats",
+    description="Current state of the connection pool of this worker and how long checkouts have waited.",
+)
+def get_pool_stats() -> schemas.PoolStatsOut:
+    return schemas.PoolStatsOut(**session_manager.pool_stats())
+
+
+@router.get(
+    '/cache',
+    summary="Per-user data cache stats",
+    description="Hits, misses and invalidations of the cache of this worker by kind of cached data.",
+)
+def get_cache_stats() -> schemas.CacheStatsOut:
+    cache = get_cache()
+    return schemas.CacheStatsOut(
+        backend=get_config().cache.backend,
+        kinds=cache.stats.as_dict() if cache is not None else {},
+    )
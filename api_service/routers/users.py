@@ -1,28 +1,52 @@
-from datetime import datetime
-from typing import List, Annotated, Optional
+from datetime import datetime, timedelta
+from typing import List, Annotated, Optional, AsyncIterator, Union, Dict
 
-from fastapi import APIRouter, Depends, status, Body, HTTPException, Response
-from starlette.responses import JSONResponse
+import orjson
+from fastapi import APIRouter, Depends, status, Body, HTTPException, Response, Query
+from fastapi.responses import StreamingResponse, ORJSONResponse
 
+import charts
 import schemas
+import serializers
+from database.models import ActivityTypes
 from database.repositories import DatabaseRepo
-from dependencies import get_db
+from database.session_manager import session_manager
+from dependencies import get_db, get_db_readonly, check_data_version
 
 router = APIRouter(prefix='/users', tags=['users'])
 
+# Headers with `ETag` of user's data version, see `check_data_version`
+VersionHeaders = Annotated[Dict[str, str], Depends(check_data_version())]
+HourlyVersionHeaders = Annotated[Dict[str, str], Depends(check_data_version(hourly=True))]
+ReadonlyVersionHeaders = Annotated[Dict[str, str], Depends(check_data_version(get_db_readonly))]
 
-@router.get('/to_notify')
-async def get_users_to_notify(db: DatabaseRepo = Depends(get_db)) -> schemas.UsersToNotifyOut:
+
+@router.get('/to_notify', response_model=schemas.UsersToNotifyOut)
+async def get_users_to_notify(db: DatabaseRepo = Depends(get_db_readonly)) -> ORJSONResponse:
     user_ids = await db.users.get_ids_to_notify(datetime.utcnow().hour) or []
-    return schemas.UsersToNotifyOut(user_ids=user_ids)
+    return ORJSONResponse({'user_ids': list(user_ids)})
 
 
 @router.put('', response_model=schemas.UserOut)
-async def create_or_update(user: schemas.UserBase, db: DatabaseRepo = Depends(get_db)):
+async def create_or_update(user: schemas.UserBase, db: DatabaseRepo = Depends(get_db)) -> ORJSONResponse:
     db_user, is_created = await db.users.create_or_update(**user.model_dump(by_alias=True))
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_201_CREATED if is_created else status.HTTP_200_OK,
-        content=schemas.UserOut.model_validate(db_user, from_attributes=True).model_dump(by_alias=True),
+        content=serializers.dump_user(db_user),
+    )
+
+
+@router.put(
+    '/batch',
+    description='Creating or updating up to 10000 users in one transaction. Order of returned users is not defined.',
+)
+async def create_or_update_many(
+        users: Annotated[List[schemas.UserBase], Body(embed=True, max_length=10_000)],
+        db: DatabaseRepo = Depends(get_db),
+) -> schemas.UsersUpsertedOut:
+    db_users = await db.users.create_or_update_many(users)
+    return schemas.UsersUpsertedOut(
+        users=[schemas.UserUpsertedOut.model_validate(db_user, from_attributes=True) for db_user in db_users]
     )
 
 
@@ -36,35 +60,82 @@ async def update_notify_hours(
     return Response(status_code=status.HTTP_200_OK, content="User's notify hours has been updated")
 
 
-@router.get('/{user_id}/notify_hours')
-async def get_notify_hours(user_id: schemas.TelegramUserId, db: DatabaseRepo = Depends(get_db)) -> schemas.UserNotifyHoursOut:
+@router.get('/{user_id}/notify_hours', response_model=schemas.UserNotifyHoursOut)
+async def get_notify_hours(
+        user_id: schemas.TelegramUserId,
+        headers: VersionHeaders,
+        db: DatabaseRepo = Depends(get_db)
+) -> ORJSONResponse:
     notify_hours = await db.users.get_notify_hours(user_id) or []
-    return schemas.UserNotifyHoursOut(notify_hours=notify_hours)
+    return ORJSONResponse({'notify_hours': notify_hours}, headers=headers)
 
 
-@router.get('/{user_id}/activities/last')
-async def get_last_activity(user_id: schemas.TelegramUserId, db: DatabaseRepo = Depends(get_db)) -> Optional[schemas.LastActivityOut]:
+@router.get('/{user_id}/activities/last', response_model=Optional[schemas.LastActivityOut])
+async def get_last_activity(
+        user_id: schemas.TelegramUserId,
+        headers: VersionHeaders,
+        db: DatabaseRepo = Depends(get_db)
+) -> ORJSONResponse:
     last_activity = await db.users.get_last_activity(user_id)
-    return schemas.LastActivityOut.model_validate(last_activity) if last_activity else None
+    return ORJSONResponse(serializers.dump_activity(last_activity), headers=headers)
+
+
+# Longest time range of missing hours, so a request can't generate an unlimited series of hours
+MAX_MISSING_HOURS_RANGE: timedelta = timedelta(days=366)
+
+
+def get_current_hour() -> datetime:
+    return datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+
+
+@router.get(
+    '/{user_id}/context',
+    description='Everything bot dialogs need on their start: time zone delta, notify hours, last activity and '
+                'hours which user has to set activities for (in user\'s time zone).',
+    response_model=schemas.UserContextOut,
+)
+async def get_context(
+        user_id: schemas.TelegramUserId,
+        headers: HourlyVersionHeaders,
+        db: DatabaseRepo = Depends(get_db)
+) -> ORJSONResponse:
+    current_hour = get_current_hour()
+    context = await db.users.get_context(user_id, current_hour)
+    if context is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {user_id} is not found")
+
+    tz_delta, notify_hours, last_activity, hours_to_submit = context
+    tz_delta = tz_delta or 0
+    return ORJSONResponse({
+        'tz_delta': tz_delta,
+        'notify_hours': notify_hours or [],
+        'last_activity': serializers.dump_activity(last_activity),
+        'current_hour': current_hour,
+        'hours_to_submit': [(hour + tz_delta) % 24 for hour in hours_to_submit],
+    }, headers=headers)
 
 
 @router.post(
     '/{user_id}/activities',
-    description='Creating new activities in UTC time.',
+    description='Creating new activities in UTC time. Activities at hours which are already set are skipped.',
     status_code=status.HTTP_201_CREATED,
 )
 async def add_activities(
         user_id: schemas.TelegramUserId,
         activities: Annotated[List[schemas.ActivityBase], Body(embed=True)],
         db: DatabaseRepo = Depends(get_db)
-):
-    # TODO проверку на то, что активности на данное время уже созданы
+) -> schemas.ActivitiesAddedOut:
     for activity in activities:
         activity.time = activity.time.replace(tzinfo=None)
         if activity.time.timestamp() > datetime.utcnow().timestamp():
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                                 detail=f"Incorrect activity time. {activity.time} is invalid")
-    await db.users.add_activities(user_id, activities)
+        # Activities are hourly, other times would duplicate hours in `actions` and be truncated in grid storage
+        if activity.time != activity.time.replace(minute=0, second=0, microsecond=0):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                                detail=f"Incorrect activity time. {activity.time} isn't a whole hour")
+    inserted, skipped = await db.users.add_activities(user_id, activities)
+    return schemas.ActivitiesAddedOut(inserted=inserted, skipped=skipped)
 
 
 @router.put('/{user_id}/tz_delta')
@@ -80,24 +151,173 @@ async def update_time_zone_delta(
     return Response(status_code=status.HTTP_200_OK, content="User's time zone delta has been updated")
 
 
-@router.get('/{user_id}/tz_delta')
+@router.get('/{user_id}/tz_delta', response_model=schemas.UserTimeZoneDeltaOut)
 async def get_time_zone_delta(
         user_id: schemas.TelegramUserId,
+        headers: VersionHeaders,
         db: DatabaseRepo = Depends(get_db)
-) -> schemas.UserTimeZoneDeltaOut:
+) -> ORJSONResponse:
     tz_delta = await db.users.get_tz_delta(user_id) or 0
-    return schemas.UserTimeZoneDeltaOut(tz_delta=tz_delta)
+    return ORJSONResponse({'tz_delta': tz_delta}, headers=headers)
 
 
-@router.get('/{user_id}/activities/summary')
+@router.get('/{user_id}/activities/summary', response_model=schemas.UserActivitiesSummaryOut)
 async def get_activity_summary(
         user_id: schemas.TelegramUserId,
+        headers: VersionHeaders,
         db: DatabaseRepo = Depends(get_db)
-) -> schemas.UserActivitiesSummaryOut:
+) -> ORJSONResponse:
     summary = await db.users.get_activities_summary(user_id)
-    return schemas.UserActivitiesSummaryOut(
-        data=[
-            schemas.UserActivitySummary(type_id=activity_type, type_name=activity_type.name, amount=amount)
-            for activity_type, amount in summary
-        ]
+    return ORJSONResponse({'data': serializers.dump_summary(summary)}, headers=headers)
+
+
+@router.get(
+    '/{user_id}/activities/series',
+    description="Amount of activity hours of every type per day, week, month or year in user's local time.",
+)
+async def get_activities_series(
+        user_id: schemas.TelegramUserId,
+        from_time: Annotated[schemas.RangeTime, Query(alias='from')],
+        to_time: Annotated[schemas.RangeTime, Query(alias='to')],
+        headers: ReadonlyVersionHeaders,
+        response: Response,
+        granularity: schemas.SeriesGranularity = schemas.SeriesGranularity.DAY,
+        db: DatabaseRepo = Depends(get_db_readonly)
+) -> schemas.ActivitiesSeriesOut:
+    response.headers.update(headers)
+    from_time, to_time = from_time.replace(tzinfo=None), to_time.replace(tzinfo=None)
+    if from_time >= to_time:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Incorrect time range. {from_time} is not earlier than {to_time}")
+
+    context = await db.users.get_context(user_id)
+    if context is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {user_id} is not found")
+
+    series = await db.users.get_activities_series(user_id, context[0] or 0, from_time, to_time, granularity.value)
+    types = list(ActivityTypes)
+    buckets: List[datetime] = []
+    counts: List[List[int]] = []
+    for bucket_start, activity_type, amount in series:
+        if not buckets or buckets[-1] != bucket_start:
+            buckets.append(bucket_start)
+            counts.append([0] * len(types))
+        counts[-1][types.index(activity_type)] = amount
+
+    return schemas.ActivitiesSeriesOut(
+        granularity=granularity,
+        types=[activity_type.name for activity_type in types],
+        buckets=buckets,
+        counts=counts,
+    )
+
+
+@router.get(
+    '/{user_id}/activities/missing',
+    description="Hours of [from, to) range in user's local time which have no activities, merged into ranges "
+                "of consecutive hours. Hours after the current one aren't missing yet.",
+    response_model=schemas.MissingHoursOut,
+)
+async def get_missing_hours(
+        user_id: schemas.TelegramUserId,
+        from_time: Annotated[schemas.RangeTime, Query(alias='from')],
+        to_time: Annotated[schemas.RangeTime, Query(alias='to')],
+        headers: HourlyVersionHeaders,
+        db: DatabaseRepo = Depends(get_db)
+) -> ORJSONResponse:
+    from_time = from_time.replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    to_time = to_time.replace(tzinfo=None, minute=0, second=0, microsecond=0)
+    if from_time >= to_time or to_time - from_time > MAX_MISSING_HOURS_RANGE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"Incorrect time range. It has to be from {from_time} to a later time, "
+                                   f"but not longer than {MAX_MISSING_HOURS_RANGE.days} days")
+
+    context = await db.users.get_context(user_id)
+    if context is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {user_id} is not found")
+
+    tz_shift = timedelta(hours=context[0] or 0)
+    from_time, to_time = from_time - tz_shift, min(to_time - tz_shift, get_current_hour())
+    missing_ranges = await db.users.get_missing_hours(user_id, from_time, to_time) if from_time < to_time else []
+    return ORJSONResponse({
+        'ranges': [{'start': start + tz_shift, 'end': end + tz_shift} for start, end in missing_ranges],
+        'amount': sum((end - start) // timedelta(hours=1) for start, end in missing_ranges),
+    }, headers=headers)
+
+
+@router.get(
+    '/{user_id}/activities/heatmap',
+    description="Activities of every hour of the year in user's local time and amounts of hours of every activity "
+                "type by weekday and hour.",
+    response_model=schemas.HeatmapOut,
+)
+async def get_activities_heatmap(
+        user_id: schemas.TelegramUserId,
+        year: Annotated[int, Query(ge=2000, le=2100)],
+        headers: VersionHeaders,
+        db: DatabaseRepo = Depends(get_db)
+) -> ORJSONResponse:
+    context = await db.users.get_context(user_id)
+    if context is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {user_id} is not found")
+
+    heatmap = await charts.get_heatmap(db, user_id, context[0] or 0, year)
+    return ORJSONResponse(heatmap, headers=headers)
+
+
+@router.get(
+    '/{user_id}/activities/charts/{chart}',
+    description="PNG chart of user's activities during the year in user's local time.",
+    response_class=Response,
+    responses={status.HTTP_200_OK: {'content': {'image/png': {}}}},
+)
+async def get_activities_chart(
+        user_id: schemas.TelegramUserId,
+        chart: schemas.ChartType,
+        year: Annotated[int, Query(ge=2000, le=2100)],
+        headers: VersionHeaders,
+        db: DatabaseRepo = Depends(get_db)
+) -> Response:
+    context = await db.users.get_context(user_id)
+    if context is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"User {user_id} is not found")
+
+    png = await charts.get_chart_png(db, user_id, context[0] or 0, chart, year)
+    return Response(png, media_type='image/png', headers=headers)
+
+
+async def stream_activities_export(
+        user_id: int, export_format: schemas.ExportFormat
+) -> AsyncIterator[Union[str, bytes]]:
+    """
+    Yield user's activities in export format by chunks. It opens its own session, because the session of
+    `get_db_readonly` dependency is closed before the response body is sent.
+    """
+    async with session_manager.create_readonly_session() as session:
+        if export_format is schemas.ExportFormat.CSV:
+            yield 'time,type\n'
+        async for partition in DatabaseRepo(session).users.stream_activities(user_id):
+            if export_format is schemas.ExportFormat.CSV:
+                yield ''.join(f'{time.isoformat()},{activity_type.name}\n' for time, activity_type in partition)
+            else:
+                yield b''.join(
+                    orjson.dumps({'time': time, 'type': activity_type.name}) + b'\n'
+                    for time, activity_type in partition
+                )
+
+
+@router.get(
+    '/{user_id}/activities/export',
+    description='Export all activities of user in UTC time. Activities are streamed, so it works for any history.',
+    response_class=StreamingResponse,
+)
+async def export_activities(
+        user_id: schemas.TelegramUserId,
+        export_format: Annotated[schemas.ExportFormat, Query(alias='format')] = schemas.ExportFormat.NDJSON,
+) -> StreamingResponse:
+    media_type = 'text/csv' if export_format is schemas.ExportFormat.CSV else 'application/x-ndjson'
+    return StreamingResponse(
+        stream_activities_export(user_id, export_format),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename="activities_{user_id}.{export_format.value}"'},
     )
@@ -1,8 +1,9 @@
+import enum
 from datetime import datetime
-from typing import List
+from typing import List, Dict
 
 from annotated_types import Gt, Lt
-from pydantic import BaseModel, ConfigDict, field_serializer, Field
+from pydantic import BaseModel, ConfigDict, field_serializer, Field, AfterValidator
 from typing_extensions import Annotated, Optional
 
 from database.models import ActivityTypes
@@ -11,6 +12,19 @@ TelegramUserId = Annotated[int, Gt(0)]
 HourNumber = Annotated[int, Gt(-1), Lt(24)]
 TzDeltaNumber = Annotated[int, Gt(-13), Lt(13)]
 
+# Bounds of time ranges of requests, so shifting times by time zone delta can't overflow `datetime`
+MIN_RANGE_TIME: datetime = datetime(1900, 1, 1)
+MAX_RANGE_TIME: datetime = datetime(2200, 1, 1)
+
+
+def check_range_time(value: datetime) -> datetime:
+    if not MIN_RANGE_TIME <= value.replace(tzinfo=None) <= MAX_RANGE_TIME:
+        raise ValueError(f'Time has to be between {MIN_RANGE_TIME} and {MAX_RANGE_TIME}')
+    return value
+
+
+RangeTime = Annotated[datetime, AfterValidator(check_range_time)]
+
 
 class UserBase(BaseModel):
     id: int = Field(..., serialization_alias="user_id")
@@ -32,6 +46,14 @@ class UserOut(UserBase):
     time_zone_delta: Optional[TzDeltaNumber] = Field(None, serialization_alias="tz_delta")
 
 
+class UserUpsertedOut(UserOut):
+    is_created: bool
+
+
+class UsersUpsertedOut(BaseModel):
+    users: List[UserUpsertedOut]
+
+
 class UserActivitySummary(BaseModel):
     type_name: str
     type_id: ActivityTypes
@@ -42,6 +64,35 @@ class UserActivitiesSummaryOut(BaseModel):
     data: List[UserActivitySummary]
 
 
+class ActivitiesAddedOut(BaseModel):
+    inserted: int
+    skipped: int
+
+
+class SeriesGranularity(str, enum.Enum):
+    DAY = 'day'
+    WEEK = 'week'
+    MONTH = 'month'
+    YEAR = 'year'
+
+
+class ActivitiesSeriesOut(BaseModel):
+    granularity: SeriesGranularity
+    types: List[str]  # Names of activity types in order of `counts` columns
+    buckets: List[datetime]  # Starts of non-empty buckets in user's local time
+    counts: List[List[int]]  # Hours of every activity type per bucket, counts[bucket_index][type_index]
+
+
+class ExportFormat(str, enum.Enum):
+    NDJSON = 'ndjson'
+    CSV = 'csv'
+
+
+class ChartType(str, enum.Enum):
+    YEAR_PIXELS = 'year_pixels'  # Activity of every hour, days are columns and hours are rows
+    STACKED_BARS = 'stacked_bars'  # Share of hours of every activity type by month
+
+
 class UsersToNotifyOut(BaseModel):
     user_ids: List[int]
 
@@ -59,3 +110,50 @@ class LastActivityOut(ActivityBase):
     model_config = ConfigDict(from_attributes=True)
 
     id: int
+
+
+class UserContextOut(BaseModel):
+    tz_delta: int
+    notify_hours: List[int]
+    last_activity: Optional[LastActivityOut]
+    current_hour: datetime  # UTC hour which `hours_to_submit` are counted up to
+    hours_to_submit: List[HourNumber]  # In user's time zone
+
+
+class HoursRangeOut(BaseModel):
+    start: datetime
+    end: datetime  # Exclusive
+
+
+class MissingHoursOut(BaseModel):
+    ranges: List[HoursRangeOut]  # Consecutive hours without activities in user's local time
+    amount: int  # Total amount of missing hours
+
+
+class HeatmapOut(BaseModel):
+    year: int
+    types: List[str]  # Names of activity types in order of `totals` and `hour_weekday`
+    totals: List[int]  # Hours of every activity type during the year
+    hour_weekday: List[List[List[int]]]  # Hours of every type by weekday (from Monday) and hour, [type][weekday][hour]
+    day_hour: List[List[int]]  # Activity type value of every hour of every day, 0 if it isn't set, [day][hour]
+
+
+class PoolStatsOut(BaseModel):
+    size: int
+    checked_in: int
+    checked_out: int
+    overflow: int
+    checkouts: int
+    wait_time_total: float  # In seconds
+    wait_time_max: float  # In seconds
+
+
+class CacheKindStatsOut(BaseModel):
+    hits: int
+    misses: int
+    invalidations: int
+
+
+class CacheStatsOut(BaseModel):
+    backend: str
+    kinds: Dict[str, CacheKindStatsOut]  # By kind of cached data, like "notify_hours"
@@ -0,0 +1,36 @@
+"""
+Direct serialization of database rows for hot endpoints. They build plain dicts which `ORJSONResponse` encodes
+to bytes right away, instead of validating a response model from the row, dumping it and encoding the dump.
+Dicts have the same shape as the response models of endpoints, which are still declared for the API schema.
+"""
+from typing import Optional, Union, List, Sequence, Tuple
+
+from sqlalchemy import Row
+
+from database.models import Activity, User, ActivityTypes
+
+
+def dump_user(user: Union[Row, User]) -> dict:
+    """ Serialize user like `schemas.UserOut`. """
+    return {
+        'id': user.id,
+        'username': user.username,
+        'language': user.language,
+        'notify_hours': user.notify_hours,
+        'tz_delta': user.time_zone_delta,
+    }
+
+
+def dump_activity(activity: Optional[Activity]) -> Optional[dict]:
+    """ Serialize activity like `schemas.LastActivityOut`. """
+    if activity is None:
+        return None
+    return {'type': activity.type.name, 'time': activity.time, 'id': activity.id}
+
+
+def dump_summary(summary: Sequence[Tuple[ActivityTypes, int]]) -> List[dict]:
+    """ Serialize activities summary like `schemas.UserActivitySummary` list. """
+    return [
+        {'type_name': activity_type.name, 'type_id': activity_type.value, 'amount': amount}
+        for activity_type, amount in summary
+    ]
@@ -1,6 +1,7 @@
 import enum
+from collections import OrderedDict
 from contextlib import asynccontextmanager
-from typing import AsyncIterator, List, Optional
+from typing import AsyncIterator, List, Optional, Any, Tuple
 
 import httpx
 from pydantic import Field
@@ -9,6 +10,11 @@ from pydantic.dataclasses import dataclass
 from config import get_config
 
 
+class ChartType(str, enum.Enum):
+    YEAR_PIXELS = 'year_pixels'
+    STACKED_BARS = 'stacked_bars'
+
+
 class ActivityTypes(enum.Enum):
     SLEEP = 1
     WORK = 2
@@ -58,6 +64,15 @@ class UserOut:
     tz_delta: int
 
 
+@dataclass
+class UserContext:
+    tz_delta: int
+    notify_hours: List[int]
+    last_activity: Optional[Activity]
+    current_hour: str = Field(..., title='UTC hour in "%Y-%m-%dT%H:%M:%S" format, `hours_to_submit` are counted to')
+    hours_to_submit: List[int] = Field(..., title="Hours to set activities for in user's time zone")
+
+
 class APIParser:
     """ Class for interaction with our API service. """
 
@@ -72,12 +87,45 @@ class APIParser:
     GET_USER_LAST_ACTIVITY_URI: str = API_DOMAIN + "/users/{user_id}/activities/last"
     POST_USER_ACTIVITIES_URI: str = API_DOMAIN + "/users/{user_id}/activities"
     GET_USER_ACTIVITIES_SUMMARY_URI: str = API_DOMAIN + "/users/{user_id}/activities/summary"
+    GET_USER_CONTEXT_URI: str = API_DOMAIN + "/users/{user_id}/context"
+    GET_USER_ACTIVITIES_CHART_URI: str = API_DOMAIN + "/users/{user_id}/activities/charts/{chart}"
 
     DATETIME_FORMAT: str = '%Y-%m-%dT%H:%M:%S'
 
+    # Data of GET responses with their ETags by URL, revalidated by conditional requests. It is shared by all
+    # instances, because a client is created for every update. The least recently used URLs are dropped
+    CONDITIONAL_CACHE_SIZE: int = 1000
+    _conditional_cache: OrderedDict[str, Tuple[str, Any]] = OrderedDict()
+
     def __init__(self, client: httpx.AsyncClient):
         self.client = client
 
+    async def get_json(self, url: str) -> Any:
+        """
+        Get JSON data by GET request. If the response had an ETag, the data is cached and the next request
+        for the URL is conditional, so API answers 304 without body and runs no queries if nothing changed.
+
+        :param url: URL of the request.
+        :return: Data of the response.
+        """
+        cached = self._conditional_cache.get(url)
+        headers = {"If-None-Match": cached[0]} if cached is not None else {}
+        response = await self.client.get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            self._conditional_cache.move_to_end(url)
+            return cached[1]
+
+        response.raise_for_status()
+        data = response.json()
+        if etag := response.headers.get("ETag"):
+            self._conditional_cache[url] = (etag, data)
+            self._conditional_cache.move_to_end(url)
+            if len(self._conditional_cache) > self.CONDITIONAL_CACHE_SIZE:
+                self._conditional_cache.popitem(last=False)
+        else:
+            self._conditional_cache.pop(url, None)
+        return data
+
     @staticmethod
     @asynccontextmanager
     async def create_client() -> AsyncIterator[httpx.AsyncClient]:
@@ -104,14 +152,14 @@ class APIParser:
         return data["user_ids"]
 
 
-    async def create_or_update_user(self, user_id: int, username: str, language: str) -> bool:
+    async def create_or_update_user(self, user_id: int, username: str, language: str) -> Tuple[UserOut, bool]:
         """
-        Create user or update user's data. Return bool is_new_user.
+        Create user or update user's data. Return user's data and bool is_new_user.
 
         :param user_id: Telegram ID of user.
         :param username: Telegram user's username.
         :param language: Telegram user's language.
-        :return: True if it is new user, false otherwise.
+        :return: User's data and True if it is new user, false otherwise.
         """
         user_data = {
             "id": user_id,
@@ -122,7 +170,7 @@ class APIParser:
         response.raise_for_status()
         api_user = UserOut(**response.json())
 
-        return response.status_code == 201 or api_user.notify_hours is None
+        return api_user, response.status_code == 201 or api_user.notify_hours is None
 
     async def update_user_notify_hours(self, user_id: int, notify_hours: List[int]) -> None:
         """
@@ -157,9 +205,7 @@ class APIParser:
         :param user_id: Telegram ID of user.
         :return: List of hours.
         """
-        response = await self.client.get(self.GET_USER_NOTIFY_HOURS_URI.format(user_id=user_id))
-        response.raise_for_status()
-        data = response.json()
+        data = await self.get_json(self.GET_USER_NOTIFY_HOURS_URI.format(user_id=user_id))
         return data["notify_hours"]
 
     async def get_user_time_zone_delta(self, user_id: int) -> int:
@@ -169,9 +215,7 @@ class APIParser:
         :param user_id: Telegram ID of user.
         :return: Hours delta of time zone.
         """
-        response = await self.client.get(self.GET_USER_TZ_DELTA_URI.format(user_id=user_id))
-        response.raise_for_status()
-        data = response.json()
+        data = await self.get_json(self.GET_USER_TZ_DELTA_URI.format(user_id=user_id))
         return data["tz_delta"]
 
     async def get_user_last_activity(self, user_id: int) -> Optional[Activity]:
@@ -181,11 +225,20 @@ class APIParser:
         :param user_id: Telegram ID of user.
         :return: If there is an activity return Activity dataclass, otherwise - None.
         """
-        response = await self.client.get(self.GET_USER_LAST_ACTIVITY_URI.format(user_id=user_id))
-        response.raise_for_status()
-        data = response.json()
+        data = await self.get_json(self.GET_USER_LAST_ACTIVITY_URI.format(user_id=user_id))
         return Activity(**data) if data else None
 
+    async def get_user_context(self, user_id: int) -> UserContext:
+        """
+        Get everything dialogs need on their start in one request: time zone delta, notify hours, last activity
+        and hours which user has to set activities for.
+
+        :param user_id: Telegram ID of user.
+        :return: UserContext dataclass.
+        """
+        data = await self.get_json(self.GET_USER_CONTEXT_URI.format(user_id=user_id))
+        return UserContext(**data)
+
     async def add_user_activities(self, user_id: int, activities: List[ActivityBaseIn]) -> None:
         """
         Add user activities to user with given user_id.
@@ -206,7 +259,20 @@ class APIParser:
         :param user_id: Telegram ID of user.
         :return: Activities summary info.
         """
-        response = await self.client.get(self.GET_USER_ACTIVITIES_SUMMARY_URI.format(user_id=user_id))
-        response.raise_for_status()
-        data = response.json()
+        data = await self.get_json(self.GET_USER_ACTIVITIES_SUMMARY_URI.format(user_id=user_id))
         return ActivitiesSummaryOut(**data) if data else None
+
+    async def get_activities_chart(self, user_id: int, chart: ChartType, year: int) -> bytes:
+        """
+        Get PNG chart of user's activities during the year in user's local time.
+
+        :param user_id: Telegram ID of user.
+        :param chart: Type of the chart.
+        :param year: The year.
+        :return: PNG image bytes.
+        """
+        response = await self.client.get(
+            self.GET_USER_ACTIVITIES_CHART_URI.format(user_id=user_id, chart=chart.value), params={"year": year}
+        )
+        response.raise_for_status()
+        return response.content
@@ -1,10 +1,13 @@
+from datetime import datetime, timedelta
 from typing import Dict
 
+import httpx
 from aiogram import Router, types, Bot
 from aiogram.filters import Command
 from aiogram.utils.chat_action import ChatActionSender
+from loguru import logger
 
-from APIParser import APIParser, ActivityTypes
+from APIParser import APIParser, ActivityTypes, ChartType, UserOut
 
 router = Router(name=__name__)
 
@@ -21,12 +24,22 @@ ACTIVITY_TO_EMOJI: Dict[ActivityTypes, str] = {
 
 
 @router.message(Command('summary'))
-async def data_summary(message: types.Message, api: APIParser, bot: Bot):
-    """ Send user's activities data summary """
-    async with ChatActionSender.typing(chat_id=message.chat.id, bot=bot):
+async def data_summary(message: types.Message, api: APIParser, api_user: UserOut, bot: Bot):
+    """ Send user's activities data summary with the chart of the current year, or only the summary without it """
+    async with ChatActionSender.upload_photo(chat_id=message.chat.id, bot=bot):
         users_data = await api.get_activities_summary(message.from_user.id)
         activity_string = '📊 Yours summary\n'
         for activity in users_data.data:
             activity_string += f'- <code>{activity.amount}</code> hours of {ACTIVITY_TO_EMOJI.get(activity.type_id, "")} <b>{activity.type_name.capitalize()}</b>'
             activity_string += f' \n'
-        await message.answer(activity_string)
+        year = (datetime.utcnow() + timedelta(hours=api_user.tz_delta or 0)).year
+        try:
+            chart = await api.get_activities_chart(message.from_user.id, ChartType.YEAR_PIXELS, year)
+        except httpx.HTTPError as e:
+            logger.error(f"Unable to get the chart of user {message.from_user.id}: {e!r}")
+            await message.answer(activity_string)
+            return
+
+        await bot.send_photo(
+            message.chat.id, types.BufferedInputFile(chart, filename=f'{year}.png'), caption=activity_string
+        )
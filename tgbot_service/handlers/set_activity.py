@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Union, Iterator
+from typing import Dict, Any, List, Union, Iterator
 
 from aiogram import Router, F
 from aiogram import types
@@ -10,7 +10,7 @@ from aiogram_dialog.widgets.input import MessageInput
 from aiogram_dialog.widgets.kbd import Cancel, Checkbox
 from aiogram_dialog.widgets.text import Const, Format
 
-from APIParser import APIParser, ActivityBaseIn, ActivityTypes, Activity
+from APIParser import APIParser, ActivityBaseIn, ActivityTypes
 from states.set_activity import SetActivityDialogSG
 
 
@@ -142,39 +142,15 @@ async def process_message(message: types.Message, _, manager: DialogManager):
     await manager.next()
 
 
-def get_hours_to_submit(last_activity: Optional[Activity] = None, to_date: Optional[datetime] = None) -> list[int]:
-    """
-    Receive last activity object and return list of hours that user can fill via activity.
-    :param last_activity: Object of last user's activity.
-    :param to_date: Deadline date to check hours without activity.
-    :return: List of hours that user can fill via activity.
-    """
-    today = to_date or datetime.utcnow()
-    if last_activity is None:  # If user is new for us - let him fill only today's hour
-        return [hour for hour in range(0, today.hour)]
-
-    # Otherwise, let user set activity to all 24 hours gap, including yesterday
-    last_activity_time = datetime.strptime(last_activity.time, APIParser.DATETIME_FORMAT)
-    if last_activity_time.date() == today.date():
-        return [hour for hour in range(last_activity_time.hour + 1, today.hour)]
-
-    if today.date() - last_activity_time.date() <= timedelta(days=1):
-        from_hour = last_activity_time.hour + 1
-    else:
-        from_hour = today.hour
-
-    return [hour % 24 for hour in range(from_hour, 24 + today.hour)]
-
-
 async def on_start(_, manager: DialogManager) -> None:
     """ Get start data for the dialog """
-    api = manager.middleware_data['api']
-    tz_delta = await api.get_user_time_zone_delta(manager.event.from_user.id)
-    last_activity = await api.get_user_last_activity(manager.event.from_user.id)
+    api: APIParser = manager.middleware_data['api']
+    context = await api.get_user_context(manager.event.from_user.id)
 
-    # Provide date to dialog for excepting errors with activity when user start the dialog in time like 17:59
-    utc_today = datetime.utcnow()
-    hours_to_submit = [(hour + tz_delta) % 24 for hour in get_hours_to_submit(last_activity, to_date=utc_today)]
+    # Provide the UTC hour which hours to submit were counted to, for excepting errors with activity when user start
+    # the dialog in time like 17:59
+    utc_today = datetime.strptime(context.current_hour, APIParser.DATETIME_FORMAT)
+    hours_to_submit = context.hours_to_submit
     if not hours_to_submit:
         if isinstance(manager.event, types.CallbackQuery):
             msg = manager.event.message
@@ -185,7 +161,7 @@ async def on_start(_, manager: DialogManager) -> None:
         return
 
     manager.dialog_data['hours_to_submit'] = hours_to_submit
-    manager.dialog_data['tz_delta'] = tz_delta
+    manager.dialog_data['tz_delta'] = context.tz_delta
     manager.dialog_data['start_date'] = utc_today
 
 
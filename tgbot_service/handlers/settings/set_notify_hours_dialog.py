@@ -68,10 +68,9 @@ async def on_start(_, manager: DialogManager):
     """ Set last saved user data for dialog from database """
     multi = manager.find(HOURS_SELECTED_BTN_ID)
     api: APIParser = manager.middleware_data['api']
-    user_notify_hours = await api.get_user_notify_hours(manager.event.from_user.id)
-    if user_notify_hours:
-        for hour in user_notify_hours:
-            await multi.set_checked(hour, True)
+    context = await api.get_user_context(manager.event.from_user.id)
+    for hour in context.notify_hours:
+        await multi.set_checked(hour, True)
 
 
 dialog = Dialog(
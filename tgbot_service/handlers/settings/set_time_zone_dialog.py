@@ -57,8 +57,8 @@ async def save_new_timezone(callback: types.CallbackQuery, _, manager: DialogMan
 async def on_start(_, manager: DialogManager):
     """ Set last saved user time zone delta for dialog from database """
     api: APIParser = manager.middleware_data['api']
-    tz_delta = await api.get_user_time_zone_delta(manager.event.from_user.id)
-    await manager.find(COUNTER_BTN_ID).set_value(tz_delta)
+    context = await api.get_user_context(manager.event.from_user.id)
+    await manager.find(COUNTER_BTN_ID).set_value(context.tz_delta)
 
 
 dialog = Dialog(
@@ -20,12 +20,13 @@ class APIConnectionMiddleware(BaseMiddleware):
         """ Create APIParser instance and pass it to the handler. Also update user info via API. """
         async with APIParser.create_client() as client:
             api = APIParser(client)
-            is_new_user = await api.create_or_update_user(
+            api_user, is_new_user = await api.create_or_update_user(
                 user_id=event.from_user.id,
                 language=event.from_user.language_code,
                 username=event.from_user.username,
             )
 
             data['api'] = api
+            data['api_user'] = api_user
             data['is_new_user'] = is_new_user
             return await handler(event, data)